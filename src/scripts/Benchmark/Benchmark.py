@@ -0,0 +1,302 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is then not reported
+    resource = None
+
+'''
+Benchmark for the export, compare and liveness pipelines of the Python scripts.
+
+Starts the SmartFace stand-in server with a fixed data set, runs every pipeline at every concurrency
+level in a fresh process and writes throughput, request latency percentiles and peak RSS to JSON.
+A previous result file can be passed as a baseline to flag throughput regressions.
+'''
+
+SCRIPTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+STANDIN_PATH = os.path.join(SCRIPTS_FOLDER, "SmartFaceStandIn", "SmartFaceStandIn.py")
+
+# Data set served by the stand-in; every run of the benchmark uses the same one
+SERVER_SETTINGS = {
+    "faces": 2000,
+    "pedestrians": 1000,
+    "genericObjects": 200,
+    "members": 10,
+    "faces_per_member": 50,
+    "image_size": 20 * 1024,
+    "latency_ms": 5.0,
+    "latency_jitter_ms": 2.0,
+    "error_rate": 0.0,
+    "seed": 1,
+}
+
+PIPELINES = ["download", "person", "members", "compare", "liveness"]
+WORKER_LEVELS = [1, 4, 16]
+
+# Sizes of the inputs created by the benchmark itself
+COMPARE_PROBES = 4
+COMPARE_MEMBERS = 3
+LIVENESS_IMAGES = 500
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def import_script(folder, name):
+    sys.path.insert(0, os.path.join(SCRIPTS_FOLDER, folder))
+    return __import__(name)
+
+def record_request_latencies():
+    # Every script sends its requests through SmartFaceClient.request, so timing it covers all of them.
+    # For streamed images this is the time until the response headers arrive.
+    sys.path.insert(0, SCRIPTS_FOLDER)
+    from smartface_client import SmartFaceClient
+
+    latencies = []
+    request = SmartFaceClient.request
+
+    def timed_request(self, method, path, retries=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return request(self, method, path, retries, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    SmartFaceClient.request = timed_request
+    return latencies
+
+def run_download(server_url, workers, folder):
+    script = import_script("DownloadAllImagesFromTimeRange", "DownloadAllImagesFromTimeRange")
+    settings = {
+        "graphql_url": server_url + "/graphql",
+        "api_url": server_url + "/api/v1/Images",
+        "save_to_folder": folder,
+        "max_workers": workers,
+        "pagination": "keyset",
+        "item_types": ["faces", "pedestrians", "genericObjects"],
+        "extra_fields": [],
+        "memory_budget": 64 * 1024 * 1024,
+        "deduplicate": True,
+        "deduplicate_max_ids": 1000000,
+        "archive_shard_size": None,
+        "manifest_path": os.path.join(folder, "manifest.sqlite"),
+    }
+    os.makedirs(os.path.join(folder, "index"), exist_ok=True)
+    script.ExportManifest(settings["manifest_path"]).close()
+    totals = script.export_shard(0, "2025-10-16T00:00:00.000Z", "2025-10-17T00:00:00.000Z", settings)
+    script.merge_shard_indexes(settings, 1)
+    return totals["downloaded"] + totals["deduplicated"] + totals["skipped"]
+
+def run_person(server_url, workers, folder):
+    # The script downloads the faces of one person one after another, workers does not apply
+    script = import_script("GetAllImagesFromPerson", "GetAllImagesFromPerson")
+    from smartface_client import SmartFaceClient
+
+    query = 'query { watchlistMembers(where: {displayName: {eq: "Lucia"}}) { items { tracklet { faces { imageDataId } } } } }'
+    with SmartFaceClient(rest_url=None, graphql_url=server_url + "/graphql") as client:
+        data = client.graphql(query)
+        image_data_ids = [face["imageDataId"] for item in data["watchlistMembers"]["items"] for face in item["tracklet"]["faces"]]
+        script.apply_curl_to_items(server_url + "/api/v1/Images", image_data_ids, folder, client=client)
+    return len(image_data_ids)
+
+def run_members(server_url, workers, folder):
+    # Bulk export of all members of the data set into one folder per member
+    script = import_script("GetAllImagesFromPerson", "GetAllImagesFromPerson")
+    from smartface_client import SmartFaceClient
+
+    names = ["Lucia"] + [f"Person {number}" for number in range(1, SERVER_SETTINGS["members"])]
+    with SmartFaceClient(rest_url=None, graphql_url=server_url + "/graphql", pool_size=workers) as client:
+        stats = script.export_members(server_url + "/api/v1/Images", names, folder, client, max_workers=workers)
+    return stats["saved"]
+
+def run_compare(server_url, workers, folder):
+    script = import_script("ComparePersonWithWatchlistMember", "ComparePersonWithWatchlistMember")
+    from smartface_client import SmartFaceClient
+
+    script.rest_api_url = server_url
+    script.graphql_url = server_url + "/graphql"
+    script.client = SmartFaceClient(script.rest_api_url, script.graphql_url)
+
+    probes = []
+    for number in range(COMPARE_PROBES):
+        probe_path = os.path.join(folder, f"probe{number}.jpg")
+        with open(probe_path, "wb") as probe_file:
+            probe_file.write(b"\xff\xd8" + os.urandom(SERVER_SETTINGS["image_size"]) + b"\xff\xd9")
+        probes.append(probe_path)
+
+    members = ["Lucia"] + [f"Person {number}" for number in range(1, COMPARE_MEMBERS)]
+    arguments = argparse.Namespace(probes=probes, members=members, workers=workers, output=os.path.join(folder, "matrix"))
+    script.run_matrix(arguments)
+    return COMPARE_PROBES * COMPARE_MEMBERS * SERVER_SETTINGS["faces_per_member"]
+
+def run_liveness(server_url, workers, folder):
+    script = import_script("LivenessCheck", "LivenessTest")
+    script.SETUP_RESTAPIURL = server_url
+    script.SETUP_RESTAPI = server_url + "/api/v1/Watchlists/Search"
+
+    zip_path = os.path.join(folder, "live_benchmark.zip")
+    with zipfile.ZipFile(zip_path, "w") as zip_file:
+        for number in range(LIVENESS_IMAGES):
+            zip_file.writestr(f"image{number}.jpg", b"\xff\xd8" + os.urandom(SERVER_SETTINGS["image_size"]) + b"\xff\xd9")
+
+    log = script.ResultWriter(os.path.join(folder, "results.csv"))
+    try:
+        return script.checkZips([zip_path], log, "benchmark", workers)
+    finally:
+        log.close()
+
+RUNNERS = {
+    "download": run_download,
+    "person": run_person,
+    "members": run_members,
+    "compare": run_compare,
+    "liveness": run_liveness,
+}
+
+def run_case(pipeline, workers, server_url):
+    # Runs in its own process, so peak RSS belongs to this pipeline only
+    latencies = record_request_latencies()
+
+    with tempfile.TemporaryDirectory() as folder, contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        items = RUNNERS[pipeline](server_url, workers, folder)
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "pipeline": pipeline,
+        "workers": workers,
+        "items": items,
+        "elapsed_s": round(elapsed, 3),
+        "items_per_s": round(items / max(elapsed, 1e-9), 2),
+        "requests": len(latencies),
+        "requests_per_s": round(len(latencies) / max(elapsed, 1e-9), 2),
+        "latency_ms": {name: round(percentile(latencies, fraction) * 1000, 2) if latencies else None
+                       for name, fraction in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))},
+        "peak_rss_mb": round(peak_rss_mb(), 1) if resource else None,
+    }
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def start_standin():
+    port = free_port()
+    command = [sys.executable, STANDIN_PATH, "--port", str(port)]
+    for name, value in SERVER_SETTINGS.items():
+        command += ["--" + name.replace("_", "-"), str(value)]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+
+    # Wait until the server accepts connections
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("The stand-in server did not start")
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=SCRIPTS_FOLDER,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_with_baseline(results, baseline_path, tolerance):
+    # Returns the cases whose throughput dropped by more than tolerance compared to the baseline
+    with open(baseline_path, "r") as baseline_file:
+        baseline = {(case["pipeline"], case["workers"]): case for case in json.load(baseline_file)["results"]}
+
+    regressions = []
+    for case in results:
+        previous = baseline.get((case["pipeline"], case["workers"]))
+        if not previous:
+            continue
+        change = case["items_per_s"] / max(previous["items_per_s"], 1e-9) - 1
+        marker = "  REGRESSION" if change < -tolerance else ""
+        print(f"{case['pipeline']:>10} x{case['workers']:<3} {previous['items_per_s']:>10.2f} -> {case['items_per_s']:>10.2f} items/s ({change:+.1%}){marker}")
+        if marker:
+            regressions.append(case)
+    return regressions
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the Python scripts against the local SmartFace stand-in.")
+    parser.add_argument("--pipelines", nargs="+", default=PIPELINES, choices=PIPELINES, help="pipelines to run")
+    parser.add_argument("--workers", nargs="+", type=int, default=WORKER_LEVELS, help="concurrency levels to run every pipeline at")
+    parser.add_argument("--output", default=None, help="result file, benchmark-<timestamp>.json by default")
+    parser.add_argument("--baseline", default=None, help="earlier result file to compare the throughput with")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed throughput drop against the baseline (0.10 = 10%%)")
+    parser.add_argument("--case", nargs=3, metavar=("PIPELINE", "WORKERS", "SERVER_URL"), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+
+    if arguments.case:
+        # Worker process: run one case and report it as a single JSON line
+        pipeline, workers, server_url = arguments.case
+        print(json.dumps(run_case(pipeline, int(workers), server_url)))
+        sys.exit()
+
+    server, server_url = start_standin()
+    results = []
+    try:
+        for pipeline in arguments.pipelines:
+            # GetAllImagesFromPerson downloads sequentially, one run is enough
+            for workers in (arguments.workers[:1] if pipeline == "person" else arguments.workers):
+                completed = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", pipeline, str(workers), server_url],
+                                           capture_output=True, text=True)
+                if completed.returncode != 0:
+                    print(f"{pipeline} with {workers} workers failed:\n{completed.stderr}")
+                    continue
+                case = json.loads(completed.stdout.strip().splitlines()[-1])
+                results.append(case)
+                print(f"{pipeline:>10} x{workers:<3} {case['items_per_s']:>10.2f} items/s, {case['requests_per_s']:>8.2f} requests/s, "
+                      f"p50/p95/p99 {case['latency_ms']['p50']}/{case['latency_ms']['p95']}/{case['latency_ms']['p99']} ms, "
+                      f"peak RSS {case['peak_rss_mb']} MB")
+    finally:
+        server.terminate()
+        server.wait()
+
+    output = arguments.output or f"benchmark-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w") as output_file:
+        json.dump({
+            "version": git_version(),
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "server": SERVER_SETTINGS,
+            "results": results,
+        }, output_file, indent=2)
+    print(f"Results written to {output}")
+
+    if arguments.baseline and compare_with_baseline(results, arguments.baseline, arguments.tolerance):
+        sys.exit(1)
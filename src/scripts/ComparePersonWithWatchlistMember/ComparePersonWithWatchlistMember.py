@@ -1,7 +1,21 @@
 import requests
+import argparse
+import array
 import base64
 import json
 import csv
+import hashlib
+import math
+import os
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# The shared SmartFace client lives next to the script folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from smartface_client import SmartFaceClient
 
 ''' 
 Here we try to get similarity between the image and each face of a watchlistmember
@@ -26,53 +40,208 @@ watchlistMember = "Lucia"
 # Path to save CSV file
 csv_file_path = "data.csv"
 
+# Images are read and encoded in chunks of this size, so the raw image is never held in memory as a whole
+image_chunk_size = 64 * 1024
+
+# Face detection settings used for both the probe and the reference image
+face_detector_config = {
+    "minFaceSize": 10,
+    "maxFaceSize": 600,
+    "confidenceThreshold": 450
+}
+face_detector_resource_id = "cpu"
+template_generator_resource_id = "cpu"
+
+# Template mode (off by default, --reference-template turns it on): the reference face is extracted once and its
+# template is cached in template_cache_folder, keyed by image hash and detector config. Verifications then send the
+# cached template instead of the reference image, so the server does not detect and extract the same reference face
+# again for every watchlist face. Only turn it on after checking that your SmartFace installation serves the two
+# endpoints below with these request bodies; they are not part of every API version.
+use_reference_template = False
+template_cache_folder = ".template_cache"
+
+# Endpoints used with a cached reference template. If the extraction or the first template verification fails,
+# the script falls back to sending the reference image with every verification.
+extract_template_url = f"{rest_api_url}/api/v1/Faces/Extract"
+verify_template_url = f"{rest_api_url}/api/v1/Faces/VerifyTemplate"
+
+# Pooled client with timeouts and retries, used by every request of the single comparison
+client = SmartFaceClient(rest_api_url, graphql_url)
+
 def imageFile_to_base64(image_path):
     with open(image_path, "rb") as image_file:
-        image_data = image_file.read()
-        base64_encoded = base64.b64encode(image_data).decode("utf-8")
-        return base64_encoded
+        return chunks_to_base64(iter(lambda: image_file.read(image_chunk_size), b""))
+
+def chunks_to_base64(chunks):
+    # Encodes a stream of byte chunks without joining the raw bytes first. Input is cut at
+    # multiples of 3 bytes so the encoded pieces concatenate into one valid base64 string.
+    encoded = bytearray()
+    remainder = b""
+    for chunk in chunks:
+        data = remainder + chunk
+        cut = len(data) - len(data) % 3
+        encoded += base64.b64encode(data[:cut])
+        remainder = data[cut:]
+    encoded += base64.b64encode(remainder)
+    return encoded.decode("utf-8")
+
+def image_request(base64_image):
+    return {
+        "image": {
+            "data": base64_image
+        },
+        "faceDetectorConfig": face_detector_config,
+        "faceDetectorResourceId": face_detector_resource_id,
+        "templateGeneratorResourceId": template_generator_resource_id
+    }
+
+def reference_cache_key(image_path):
+    image_hash = hashlib.sha256()
+    with open(image_path, "rb") as image_file:
+        for chunk in iter(lambda: image_file.read(image_chunk_size), b""):
+            image_hash.update(chunk)
+
+    detector_settings = json.dumps([face_detector_config, face_detector_resource_id, template_generator_resource_id], sort_keys=True)
+    config_hash = hashlib.sha256(detector_settings.encode("utf-8")).hexdigest()
+    return image_hash.hexdigest() + "-" + config_hash[:16]
+
+def load_reference_template(image_path, base64_image):
+    cache_path = os.path.join(template_cache_folder, reference_cache_key(image_path) + ".json")
+
+    if os.path.exists(cache_path):
+        with open(cache_path, "r") as cache_file:
+            print("Using cached reference template " + cache_path)
+            return json.load(cache_file)["template"]
+
+    try:
+        response = client.post(extract_template_url, json=image_request(base64_image))
+    except requests.exceptions.RequestException as e:
+        print(f"An error occurred while extracting the reference template, Error: {e}")
+        return None
+
+    if response.status_code != 200:
+        print("Reference template extraction failed with status code:", response.status_code)
+        return None
+
+    # The first detected face is the reference face
+    data = response.json()
+    faces = data if isinstance(data, list) else data.get("faces", [data])
+    template = faces[0].get("template") if faces else None
+    if not template:
+        print("No reference template was returned")
+        return None
+
+    os.makedirs(template_cache_folder, exist_ok=True)
+    with open(cache_path, "w") as cache_file:
+        json.dump({"image": image_path, "template": template}, cache_file)
+    print("Reference template cached in " + cache_path)
+    return template
 
 def image_to_base64(image_file):
     base64_encoded = base64.b64encode(image_file).decode("utf-8")
     return base64_encoded
 
-def run_graphql_query(paginated_query, graphql_url):
-    headers = {'Content-Type': 'application/json'}
-    payload = {'query': paginated_query}
+def run_graphql_query(paginated_query, http=None):
     try:
-        response = requests.post(graphql_url, headers=headers, json=payload)
-        response_data = response.json()
-        return response_data
+        return (http or client).graphql_response(paginated_query)
     except requests.exceptions.RequestException as e:
         print(f"An error occurred during the API request: {e}")
         return None
 
-def fetch_items(query, graphql_url):
-
-    paginated_query = query.replace("{FullName}",watchlistMember)
-    response_data = run_graphql_query(paginated_query, graphql_url)
+def fetch_items(query, member=None, http=None):
+    # Returns no image ids when the query fails, so in matrix mode the member's column stays NaN
+    member = member or watchlistMember
+    paginated_query = query.replace("{FullName}", member)
+    response_data = run_graphql_query(paginated_query, http)
 
     if response_data is None:
-        print("No data was returned")
+        print(f"No data was returned for {member}")
+        return []
 
-    # Check for errors in response data
+    # Check for errors in response data, a partial result is still used
     if 'errors' in response_data:
-        print(f"Error in response data: {response_data['errors']}")
-        
+        print(f"Error in response data for {member}: {response_data['errors']}")
+
+    members = ((response_data.get("data") or {}).get("watchlistMembers") or {}).get("items")
+    if members is None:
+        print(f"No watchlist members were returned for {member}")
+        return []
+
     items = []
-    for item in response_data["data"]["watchlistMembers"]["items"]:
-        for face in item["tracklet"]["faces"]:
+    for item in members:
+        for face in (item.get("tracklet") or {}).get("faces") or []:
             items.append(face["imageDataId"])
 
     return items
 
+def load_reference(image_path):
+    # We get base 64 of the image you want to compare, and extract its template once or reuse it from an earlier run
+    base64_image = imageFile_to_base64(image_path)
+    template = load_reference_template(image_path, base64_image) if use_reference_template and template_cache_folder else None
+    # "template_checked" is set once the first template verification showed whether the server takes the template
+    return {"image": base64_image, "template": template, "template_checked": False, "lock": threading.Lock()}
+
+def template_rejected(response):
+    # The endpoint is missing or does not take this request body. A 400 for a face that cannot be detected is
+    # the answer for that probe, a 400 for a body that does not match the schema lists the validation errors.
+    if response.status_code in (404, 405, 415):
+        return True
+    if response.status_code != 400:
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    return isinstance(body, dict) and isinstance(body.get("errors"), dict)
+
+def verify_with_template(http, headers, imagebase64, template):
+    json_payload = {
+                    "probeImage": image_request(imagebase64),
+                    "referenceTemplate": {
+                        "data": template
+                    }
+                }
+    return http.post(verify_template_url, headers=headers, json=json_payload)
+
+def verify_probe(api_url, headers, imagebase64, reference=None, http=None):
+    # http is a SmartFaceClient, the shared module client by default
+    http = http or client
+    if reference is None:
+        reference = personToCompare_reference
+
+    if reference["template"] and not reference["template_checked"]:
+        # The first template verification decides for good whether the template is used; in matrix mode
+        # the other threads that verify against this reference wait for it
+        with reference["lock"]:
+            if not reference["template_checked"]:
+                response = verify_with_template(http, headers, imagebase64, reference["template"])
+                rejected = template_rejected(response)
+                if rejected:
+                    print(f"Verification with a template was rejected with status code {response.status_code}, the reference image will be sent instead")
+                    reference["template"] = None
+                # Set last, so a thread that skips the lock never sees a template that was just rejected
+                reference["template_checked"] = True
+                if not rejected:
+                    return response
+
+    # Read once, the template does not change after the check
+    template = reference["template"]
+    if template:
+        return verify_with_template(http, headers, imagebase64, template)
+
+    json_payload = {
+                    "probeImage": image_request(imagebase64),
+                    "referenceImage": image_request(reference["image"])
+                }
+    return http.post(f"{api_url}/api/v1/Faces/Verify", headers=headers, json=json_payload)
+
 def processImageDataIds(api_url, image_data_ids):
     for image_id in image_data_ids:
         url = f"{api_url}/api/v1/Images/{image_id}"
         headers = {"accept": "image/jpeg"}
 
         try:    
-            response = requests.get(url, headers=headers)
+            response = client.get(url, headers=headers, stream=True)
 
         except requests.exceptions.RequestException as e:
             print(f"An error occurred while processing image with id: {image_id}, Error: {e}")
@@ -84,45 +253,14 @@ def processImageDataIds(api_url, image_data_ids):
 
             #print(response.content)
 
-            imagebase64 = image_to_base64(response.content)
+            # The body is encoded chunk by chunk while it streams in; only the base64 copy is kept
+            imagebase64 = chunks_to_base64(response.iter_content(chunk_size=image_chunk_size))
         
             if(imagebase64 != None):
                 print("Got an image for image id " + image_id + ".")
                 
                 try:
-                    json_payload = {                  
-                                    "probeImage": {
-                                        "image": {
-                                        "data": imagebase64
-                                        },
-                                        "faceDetectorConfig": {
-                                        "minFaceSize": 10,
-                                        "maxFaceSize": 600,
-                                        "confidenceThreshold": 450
-                                        },
-                                        "faceDetectorResourceId": "cpu",
-                                        "templateGeneratorResourceId": "cpu"
-                                    },
-                                    "referenceImage": {
-                                        "image": {
-                                        "data": personToCompare_base64_encoded_image
-                                        },
-                                        "faceDetectorConfig": {
-                                        "minFaceSize": 10,
-                                        "maxFaceSize": 600,
-                                        "confidenceThreshold": 450
-                                        },
-                                        "faceDetectorResourceId": "cpu",
-                                        "templateGeneratorResourceId": "cpu"
-                                    }
-                                    }
-                
-                    #print(json_payload)    
-                    
-                    url = f"{api_url}/api/v1/Faces/Verify"
-                    
-                    #print(url)
-                    response = requests.post(url, headers=headers, json=json_payload)
+                    response = verify_probe(api_url, headers, imagebase64)
                 
                 except requests.exceptions.RequestException as e:
                     print(f"An error occurred while verifying confidence score for and image: {image_id}, Error: {e}")
@@ -163,29 +301,179 @@ query = '''
   }
 }
     '''
-results = []
 
-# we get all the image data for the watchlistmember
-items = fetch_items(query, graphql_url)
+# Matrix mode: every probe image is verified against every face of every listed watchlist member
+probe_extensions = (".png", ".jpg", ".jpeg", ".bmp")
+matrix_workers = 8
+progress_interval = 2.0
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Compare a person with the faces of watchlist members.")
+    parser.add_argument("--matrix", action="store_true", help="compare every probe image with every listed watchlist member")
+    parser.add_argument("--probes", nargs="+", default=[personToCompare], help="probe image files or folders with probe images")
+    parser.add_argument("--members", nargs="+", default=[watchlistMember], help="watchlist member full names, or a .txt file with one name per line")
+    parser.add_argument("--workers", type=int, default=matrix_workers, help="maximum number of verifications in flight")
+    parser.add_argument("--output", default="matrix", help="output path prefix for the .csv and .npy similarity matrix")
+    parser.add_argument("--reference-template", action="store_true", help="extract and cache the reference template and verify with it (see use_reference_template)")
+    return parser.parse_args()
+
+def collect_probe_files(paths):
+    probe_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            probe_files.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith(probe_extensions)))
+        else:
+            probe_files.append(path)
+    return probe_files
+
+def collect_members(values):
+    members = []
+    for value in values:
+        if value.endswith(".txt") and os.path.isfile(value):
+            with open(value, "r", encoding="utf-8") as members_file:
+                members.extend(line.strip() for line in members_file if line.strip())
+        else:
+            members.append(value)
+    return members
+
+def create_session(pool_size):
+    return SmartFaceClient(rest_api_url, graphql_url, pool_size=pool_size)
+
+def download_image_base64(session, api_url, image_id):
+    try:
+        with session.get(f"{api_url}/api/v1/Images/{image_id}", headers={"accept": "image/jpeg"}, stream=True) as response:
+            if response.status_code == 200:
+                return chunks_to_base64(response.iter_content(chunk_size=image_chunk_size))
+            print(f"Failed to retrieve image with id: {image_id}, Status code: {response.status_code}")
+    except requests.exceptions.RequestException as e:
+        print(f"An error occurred while processing image with id: {image_id}, Error: {e}")
+    return None
+
+def verify_confidence(session, api_url, face_base64, reference):
+    # Confidence of one verification, 0 when no face was found and None when the request failed
+    try:
+        response = verify_probe(api_url, {"accept": "application/json"}, face_base64, reference, session)
+    except requests.exceptions.RequestException as e:
+        print(f"An error occurred while verifying, Error: {e}")
+        return None
+
+    if response.status_code == 200:
+        return response.json()["confidence"]
+    if response.status_code == 400:
+        return 0
+    print("Request failed with status code:", response.status_code)
+    return None
+
+class Progress:
+    # Prints one progress line every progress_interval seconds instead of a line per verification
 
-# We get base 64 of the image you want to compare
-personToCompare_base64_encoded_image = imageFile_to_base64(personToCompare)
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.start = time.perf_counter()
+        self.last_print = self.start
 
-# we setup a header for the output csv file
-results.append("image,confidence, facesize")
+    def advance(self):
+        self.done += 1
+        now = time.perf_counter()
+        if now - self.last_print >= progress_interval or self.done == self.total:
+            self.last_print = now
+            print(f"{self.done}/{self.total} verifications, {self.done / max(now - self.start, 1e-9):.1f} verifications/s")
 
-# we will process each file in here
-processImageDataIds(rest_api_url, items)
+def write_matrix_csv(path, probes, members, matrix):
+    with open(path, "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["probe"] + members)
+        for probe, row in zip(probes, matrix):
+            writer.writerow([probe] + ["" if math.isnan(value) else value for value in row])
 
-# log the outcome
-try: 
-    with open(csv_file_path, "w") as csv_file:
-        for row in results:
-            csv_file.write(row+"\n")
+def write_matrix_npy(path, matrix):
+    # Float32 matrix in the NumPy .npy format (readable with numpy.load), written without requiring NumPy
+    rows, columns = len(matrix), len(matrix[0]) if matrix else 0
+    values = array.array("f", (value for row in matrix for value in row))
+    if sys.byteorder == "big":
+        values.byteswap()
 
-except requests.exceptions.RequestException as e:
-    print(f"An error occurred while trying to save the results into a CSV file, Error: {e}")
+    header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (rows, columns)
+    header += " " * (63 - (10 + len(header)) % 64) + "\n"
+    with open(path, "wb") as npy_file:
+        npy_file.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1"))
+        npy_file.write(values.tobytes())
+
+def run_matrix(arguments):
+    probes = collect_probe_files(arguments.probes)
+    members = collect_members(arguments.members)
+    if not probes or not members:
+        print("There is nothing to compare.")
+        return
+
+    print(f"Comparing {len(probes)} probe images with {len(members)} watchlist members")
+    session = create_session(arguments.workers)
+    start = time.perf_counter()
+
+    # Unverified cells stay NaN; each cell keeps the best confidence over all faces of the member
+    matrix = [[math.nan] * len(members) for _ in probes]
+
+    with ThreadPoolExecutor(max_workers=arguments.workers) as executor:
+        # Every probe is a reference: its image is encoded and its template extracted once for the whole run
+        references = list(executor.map(load_reference, probes))
+        verifications = 0
+
+        for column, member in enumerate(members):
+            # Faces are downloaded and verified one member at a time, which bounds the images held in memory
+            face_ids = list(dict.fromkeys(fetch_items(query, member, session)))
+            faces = [face for face in executor.map(lambda image_id: download_image_base64(session, rest_api_url, image_id), face_ids) if face]
+            print(f"{member}: {len(faces)} faces")
+
+            progress = Progress(len(faces) * len(probes))
+            futures = {executor.submit(verify_confidence, session, rest_api_url, face, references[row]): row
+                       for face in faces for row in range(len(probes))}
+            for future in as_completed(futures):
+                row = futures[future]
+                confidence = future.result()
+                if confidence is not None and (math.isnan(matrix[row][column]) or confidence > matrix[row][column]):
+                    matrix[row][column] = confidence
+                progress.advance()
+            verifications += len(futures)
+
+    session.close()
+    elapsed = time.perf_counter() - start
+
+    write_matrix_csv(arguments.output + ".csv", probes, members, matrix)
+    write_matrix_npy(arguments.output + ".npy", matrix)
+    print(f"Similarity matrix written to {arguments.output}.csv and {arguments.output}.npy")
+    print(f"{verifications} verifications in {elapsed:.2f} s ({verifications / max(elapsed, 1e-9):.1f} verifications/s)")
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    use_reference_template = use_reference_template or arguments.reference_template
+
+    if arguments.matrix:
+        run_matrix(arguments)
+    else:
+        results = []
+
+        # we get all the image data for the watchlistmember
+        items = fetch_items(query)
+
+        # We get base 64 of the image you want to compare and its reference template
+        personToCompare_reference = load_reference(personToCompare)
+
+        # we setup a header for the output csv file
+        results.append("image,confidence, facesize")
+
+        # we will process each file in here
+        processImageDataIds(rest_api_url, items)
+
+        # log the outcome
+        try: 
+            with open(csv_file_path, "w") as csv_file:
+                for row in results:
+                    csv_file.write(row+"\n")
+
+        except requests.exceptions.RequestException as e:
+            print(f"An error occurred while trying to save the results into a CSV file, Error: {e}")
 
-# here we will print the outcome
-for item in results:
-    print(item)
\ No newline at end of file
+        # here we will print the outcome
+        for item in results:
+            print(item)
@@ -1,144 +1,571 @@
+import csv
+import datetime
+import heapq
+import itertools
 import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
 import requests
 
-def run_graphql_query(paginated_query, graphql_url):
-    headers = {'Content-Type': 'application/json'}
-    payload = {'query': paginated_query}
+# The shared SmartFace client lives next to the script folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from smartface_client import ImageArchive, SmartFaceClient, bounded_map, link_file, stream_to_archive, stream_to_file
+
+def run_graphql_query(paginated_query, client):
     try:
-        response = requests.post(graphql_url, headers=headers, json=payload)
-        response_data = response.json()
-        return response_data
+        return client.graphql_response(paginated_query)
     except requests.exceptions.RequestException as e:
         print(f"An error occurred during the API request: {e}")
         return None
 
-def fetch_items_with_pagination(query, item_type, graphql_url, timefrom, timeto):
-    all_items = []
+# Filters applied on top of the time range, per object type
+ENTITY_FILTERS = {
+    "faces": ["{ size: { gt: 80 } }"],
+    "pedestrians": [],
+    "genericObjects": [],
+}
+
+DEFAULT_FIELDS = ["id", "createdAt", "imageDataId"]
+
+QUERY_TEMPLATE = '''
+    query {
+      {item_type}(take: {take}, skip: {skip}, order: [{createdAt:ASC}, {id:ASC}],where: {
+        and: [
+          {filters}
+        ]
+      }) {
+        items {
+          {fields}
+        }
+      }
+    }
+    '''
+
+COUNT_TEMPLATE = '''
+    query {
+      {item_type}(where: {
+        and: [
+          {filters}
+        ]
+      }) {
+        totalCount
+      }
+    }
+    '''
+
+def entity_filters(item_type):
+    # The window includes timefrom and excludes timeto, so adjacent windows never overlap or leave gaps
+    return ENTITY_FILTERS[item_type] + [
+        '{ createdAt: { gte: "{timefrom}" }},',
+        '{ createdAt: { lt: "{timeto}" }}',
+    ]
+
+def build_query(item_type, extra_fields=()):
+    # Only the object type being paged is requested, so the server does not resolve the other types
+    filters = ["{keyset}"] + entity_filters(item_type)
+    fields = DEFAULT_FIELDS + [field for field in extra_fields if field not in DEFAULT_FIELDS]
+
+    return QUERY_TEMPLATE.replace('{item_type}', item_type).replace('{filters}', "\n          ".join(filters)).replace('{fields}', ",\n          ".join(fields))
+
+def build_count_query(item_type):
+    return COUNT_TEMPLATE.replace('{item_type}', item_type).replace('{filters}', "\n          ".join(entity_filters(item_type)))
+
+def keyset_filter(watermark):
+    # Items strictly after the last (createdAt, id) pair that was already returned
+    if watermark is None:
+        return ""
+    created_at, item_id = watermark
+    return (f'{{ or: [ {{ createdAt: {{ gt: "{created_at}" }} }}, '
+            f'{{ and: [ {{ createdAt: {{ eq: "{created_at}" }} }}, {{ id: {{ gt: "{item_id}" }} }} ] }} ] }}')
+
+def iter_pages(query, item_type, client, timefrom, timeto, take=1000, pagination="keyset", watermark=None):
+    # Yields one page of items at a time so callers can process results while paging continues.
+    # "keyset" moves a (createdAt, id) watermark forward, so every page costs the same on the server.
+    # "offset" uses take/skip, where the server re-scans all skipped rows for every page.
+    # A starting watermark resumes paging right after that item.
     skip = 0
-    take = 1000
-    
+
     while True:
-        paginated_query = query.replace('{take}', str(take)).replace('{skip}', str(skip)).replace('{timefrom}', str(timefrom)).replace('{timeto}', str(timeto))
-        response_data = run_graphql_query(paginated_query, graphql_url)
+        paginated_query = query.replace('{take}', str(take)).replace('{skip}', str(skip)).replace('{timefrom}', str(timefrom)).replace('{timeto}', str(timeto)).replace('{keyset}', keyset_filter(watermark))
+        response_data = run_graphql_query(paginated_query, client)
 
         if response_data is None:
-            # Request failed, break the loop
-            break
+            # Request failed, stop paging
+            return
 
         # Check for errors in response data
         if 'errors' in response_data:
             print(f"Error in response data: {response_data['errors']}")
-            break
+            return
 
         data = response_data.get('data', {})
         items = data.get(item_type, {}).get('items', [])
 
         if not items:
-            break
-        
-        all_items.extend(items)
-        skip += take
+            return
+
+        yield items
+
+        if len(items) < take:
+            return
 
+        if pagination == "keyset":
+            last = items[-1]
+            watermark = (last['createdAt'], last['id'])
+        else:
+            skip += take
+
+def fetch_items_with_pagination(query, item_type, client, timefrom, timeto, pagination="keyset"):
+    all_items = []
+    for items in iter_pages(query, item_type, client, timefrom, timeto, pagination=pagination):
+        all_items.extend(items)
     return all_items
 
-def apply_curl_to_items(api_url, image_data_ids, save_to_folder, object_type):
-    # Create subfolder for the object type
-    subfolder = os.path.join(save_to_folder, object_type)
-    os.makedirs(subfolder, exist_ok=True)
-    
-    for image_id in image_data_ids:
-        url = f"{api_url}/{image_id}"
-        headers = {"accept": "image/jpeg"}
+class ExportManifest:
+    # On-disk record of downloaded image ids and the last exported (createdAt, id) per object type and
+    # time window. A rerun skips ids it already has and continues paging from the checkpoint of its window.
 
-        try:
-            response = requests.get(url, headers=headers)
+    def __init__(self, path, commit_every=500):
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.commit_every = commit_every
+        self.pending = 0
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS downloaded (item_type TEXT, image_id TEXT, size INTEGER, PRIMARY KEY (item_type, image_id))")
+            # Checkpoints belong to one (range_from, range_to) window. The older "checkpoints" table without
+            # the window end is no longer read, its windows are paged again and their images skipped.
+            self.connection.execute("CREATE TABLE IF NOT EXISTS window_checkpoints (item_type TEXT, range_from TEXT, range_to TEXT, created_at TEXT, item_id TEXT, PRIMARY KEY (item_type, range_from, range_to))")
+            # Earlier versions stored the DEDUPLICATED marker as the size of deduplicated images; their size is unknown
+            if self.connection.execute("PRAGMA user_version").fetchone()[0] < 1:
+                self.connection.execute("UPDATE downloaded SET size = NULL WHERE size < 0")
+                self.connection.execute("PRAGMA user_version = 1")
+            self.connection.commit()
+
+    def is_downloaded(self, image_id, item_type):
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM downloaded WHERE item_type = ? AND image_id = ?", (item_type, image_id)).fetchone()
+        return row is not None
+
+    def mark_downloaded(self, image_id, item_type, size):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO downloaded (item_type, image_id, size) VALUES (?, ?, ?)", (item_type, image_id, size))
+            self.pending += 1
+            if self.pending >= self.commit_every:
+                self.connection.commit()
+                self.pending = 0
+
+    def get_checkpoint(self, item_type, range_from, range_to):
+        with self.lock:
+            return self.connection.execute("SELECT created_at, item_id FROM window_checkpoints WHERE item_type = ? AND range_from = ? AND range_to = ?",
+                                           (item_type, window_key(range_from), window_key(range_to))).fetchone()
+
+    def set_checkpoint(self, item_type, range_from, range_to, watermark):
+        created_at, item_id = watermark
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO window_checkpoints (item_type, range_from, range_to, created_at, item_id) VALUES (?, ?, ?, ?, ?)",
+                                    (item_type, window_key(range_from), window_key(range_to), created_at, item_id))
+            self.connection.commit()
+            self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+def parse_time(value):
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+def window_key(value):
+    # The same instant always gives the same key, however the time was written
+    return parse_time(value).isoformat()
+
+def resume_point(manifest, item_type, timefrom, timeto):
+    # Only the checkpoint written for exactly this window is reused, so shards never continue from or
+    # overwrite each other's progress. A window without one is paged from its start; the images that
+    # are already in the manifest are still skipped.
+    checkpoint = manifest.get_checkpoint(item_type, timefrom, timeto) if manifest else None
+    if checkpoint is None:
+        return None
+
+    created_at, item_id = checkpoint
+    if not parse_time(timefrom) <= parse_time(created_at) < parse_time(timeto):
+        return None
+    print(f"Resuming {item_type} from checkpoint {created_at}")
+    return created_at, item_id
+
+def create_session(max_workers, graphql_url=None):
+    # One shared client keeps TCP connections alive between image and GraphQL requests and retries
+    # requests that fail on a busy server. The pool is sized to the worker count so no worker waits
+    # for a free connection.
+    return SmartFaceClient(rest_url=None, graphql_url=graphql_url, pool_size=max_workers, timeout=30)
+
+def download_image(session, api_url, image_id, subfolder, archive=None, buffer_size=256 * 1024):
+    # Returns (size, location), where location is the file path or the archive index entry.
+    # The body is streamed in chunks, so at most about buffer_size bytes of it are held in memory.
+    url = f"{api_url}/{image_id}"
+    headers = {"accept": "image/jpeg"}
+    chunk_size = max(buffer_size // 2, 4096)
+
+    try:
+        with session.get(url, headers=headers, timeout=30, stream=True) as response:
 
             # Check if the request was successful (status code 200)
             if response.status_code == 200:
+                if archive:
+                    entry = stream_to_archive(response, archive, image_id, chunk_size)
+                    return entry[2], entry
+
                 # Save the image data to a file in the specified subfolder
                 file_path = os.path.join(subfolder, f"{image_id}.jpg")
-                with open(file_path, "wb") as file:
-                    file.write(response.content)
-                print(f"Image saved: {file_path}")
+                return stream_to_file(response, file_path, chunk_size), file_path
             else:
                 print(f"Failed to retrieve image with id: {image_id}, Status code: {response.status_code}")
 
-        except requests.exceptions.RequestException as e:
-            print(f"An error occurred while processing image with id: {image_id}, Error: {e}")
+    except requests.exceptions.RequestException as e:
+        print(f"An error occurred while processing image with id: {image_id}, Error: {e}")
 
+    return None, None
 
-if __name__ == '__main__':
-    graphql_url = 'http://YOUR-URL:8097/graphql/'   # Replace with the actual GraphQL API endpoint URL
-    api_url = 'http://YOUR-URL:8098/api/v1/Images'  # Replace with the actual API endpoint for image retrieval
-    save_to_folder = "./images/"                  
-    timefrom = "2025-10-16T00:00:00.000Z"                # Replace with your DATETIME
-    timeto = "2025-10-16T23:59:59.000Z"                  # Replace with your DATETIME
+def print_throughput_summary(object_type, stats):
+    elapsed = max(stats["elapsed"], 1e-9)
+    megabytes = stats["bytes"] / (1024 * 1024)
+    print(f"{object_type}: {stats['downloaded']} images saved, {stats['skipped']} already exported, "
+          f"{stats['deduplicated']} requests saved by deduplication, {stats['failed']} failed, "
+          f"{megabytes:.2f} MB in {elapsed:.2f} s "
+          f"({stats['downloaded'] / elapsed:.2f} images/s, {megabytes / elapsed:.2f} MB/s)")
 
-    query = '''
-    query {
-      faces(take: {take}, skip: {skip}, order: {createdAt:ASC},where: {
-        and: [
-          { size: { gt: 80 } }
-          { createdAt: { gt: "{timefrom}" }},
-          { createdAt: { lt: "{timeto}" }}
-        ]
-      }) {
-        items {
-          id,
-          createdAt,
-          imageDataId
-        }
-      }
-      pedestrians(take: {take}, skip: {skip}, order: {createdAt:ASC},where: {
-        and: [
-          { createdAt: { gt: "{timefrom}" }},
-          { createdAt: { lt: "{timeto}" }}
-        ]
-      }) {
-        items {
-          id,
-          createdAt,
-          imageDataId
-        }
-      }
-      genericObjects(take: {take}, skip: {skip}, order: {createdAt:ASC},where: {
-        and: [
-          { createdAt: { gt: "{timefrom}" }},
-          { createdAt: { lt: "{timeto}" }}
-        ]
-      }) {
-        items {
-          id,
-          createdAt,
-          imageDataId
-        }
-      }
+# Markers returned for ids the manifest already has and for ids another entity already fetched
+SKIPPED = -1
+DEDUPLICATED = -2
+
+class ImageDeduplicator:
+    # Makes sure every imageDataId is fetched once per process, even when several object types
+    # or tracklet faces refer to the same image. The first caller fetches, later callers wait for
+    # that fetch and then reference its result instead of requesting the image again.
+    # Only fetches in flight hold a Future. Once a fetch is done just the location of the image is kept,
+    # for the most recent max_entries ids; an older id is fetched again if it shows up once more.
+
+    def __init__(self, max_entries=1000000):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.locations = OrderedDict()
+        self.max_entries = max_entries
+
+    def fetch(self, image_id, download):
+        # Returns the (size, location) of download() for the caller that fetched the image,
+        # (DEDUPLICATED, location) for later callers and (None, None) when the fetch failed
+        with self.lock:
+            location = self.locations.get(image_id)
+            if location is not None:
+                self.locations.move_to_end(image_id)
+                return DEDUPLICATED, location
+            future = self.in_flight.get(image_id)
+            is_owner = future is None
+            if is_owner:
+                future = self.in_flight[image_id] = Future()
+
+        if not is_owner:
+            size, location = future.result()
+            return (None, None) if size is None else (DEDUPLICATED, location)
+
+        try:
+            size, location = download()
+        except BaseException as e:
+            with self.lock:
+                del self.in_flight[image_id]
+            future.set_exception(e)
+            raise
+
+        # Failed fetches are not remembered, so the next entity that uses the image tries again
+        with self.lock:
+            del self.in_flight[image_id]
+            if size is not None:
+                self.locations[image_id] = location
+                if len(self.locations) > self.max_entries:
+                    self.locations.popitem(last=False)
+        future.set_result((size, location))
+        return size, location
+
+def apply_curl_to_items(api_url, image_data_ids, save_to_folder, object_type, max_workers=16, session=None, executor=None, manifest=None, on_done=None, archive=None, deduplicator=None, memory_budget=64 * 1024 * 1024):
+    # Create subfolder for the object type, unless the images are packed into an archive
+    subfolder = os.path.join(save_to_folder, object_type)
+    if archive is None:
+        os.makedirs(subfolder, exist_ok=True)
+
+    own_session = session is None
+    if own_session:
+        session = create_session(max_workers)
+
+    # A shared executor lets several object types draw from one concurrency limit
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    stats = {"downloaded": 0, "skipped": 0, "deduplicated": 0, "failed": 0, "bytes": 0, "elapsed": 0.0}
+    start = time.perf_counter()
+
+    # Every in-flight download buffers at most its share of the budget, so peak memory
+    # depends on the budget and not on image sizes
+    buffer_size = max(memory_budget // max_workers, 8 * 1024)
+
+    def fetch(image_id):
+        # Returns (result, size): result is the size, DEDUPLICATED or None for the stats, size the bytes of the image
+        if deduplicator is None:
+            size, _ = download_image(session, api_url, image_id, subfolder, archive, buffer_size)
+            return size, size
+
+        result, location = deduplicator.fetch(image_id, lambda: download_image(session, api_url, image_id, subfolder, archive, buffer_size))
+        if result != DEDUPLICATED:
+            return result, result
+        if archive:
+            archive.add_reference(image_id, location)
+            return DEDUPLICATED, location[2]
+        file_path = os.path.join(subfolder, f"{image_id}.jpg")
+        link_file(location, file_path)
+        return DEDUPLICATED, os.path.getsize(file_path)
+
+    def download(image_id):
+        if manifest and manifest.is_downloaded(image_id, object_type):
+            return image_id, SKIPPED
+        result, size = fetch(image_id)
+        if result is not None and manifest:
+            manifest.mark_downloaded(image_id, object_type, size)
+        return image_id, result
+
+    try:
+        # At most max_workers downloads are in flight at any time; results come back in input order
+        for image_id, size in bounded_map(executor, download, image_data_ids, max_workers * 2):
+            if size is None:
+                stats["failed"] += 1
+            elif size == SKIPPED:
+                stats["skipped"] += 1
+            elif size == DEDUPLICATED:
+                stats["deduplicated"] += 1
+            else:
+                stats["downloaded"] += 1
+                stats["bytes"] += size
+            if on_done:
+                on_done(image_id, size)
+    finally:
+        if own_executor:
+            executor.shutdown()
+        if own_session:
+            session.close()
+
+    stats["elapsed"] = time.perf_counter() - start
+    print_throughput_summary(object_type, stats)
+    return stats
+
+def export_items(item_type, settings, timefrom, timeto, session, executor, manifest=None, shard=0, deduplicator=None):
+    print(f"Fetching {item_type} from {timefrom} to {timeto}...")
+    query = build_query(item_type, settings["extra_fields"])
+    watermark = resume_point(manifest, item_type, timefrom, timeto)
+
+    # Items whose downloads are still pending, in paging order, plus the position of the last item
+    # of every page with that page's watermark. The checkpoint moves forward only once every item up
+    # to that position has finished and nothing has failed so far.
+    pending_items = deque()
+    page_ends = deque()
+    progress = {"produced": 0, "finished": 0, "failed": False}
+
+    def image_ids():
+        # Downloads start as soon as the first page arrives; only a bounded window of ids is held in memory
+        for page in iter_pages(query, item_type, session, timefrom, timeto, pagination=settings["pagination"], watermark=watermark):
+            progress["produced"] += len(page)
+            page_ends.append((progress["produced"], (page[-1]['createdAt'], page[-1]['id'])))
+            for item in page:
+                pending_items.append(item)
+                yield item['imageDataId']
+
+    index_file = open(shard_index_path(settings, item_type, shard), "w", newline="")
+    index_writer = csv.writer(index_file)
+
+    archive = None
+    if settings["archive_shard_size"]:
+        # Every worker process packs into its own archive, so no two processes append to the same tar
+        archive = ImageArchive(settings["save_to_folder"], f"{item_type}-{shard:04d}", settings["archive_shard_size"])
+
+    def on_done(image_id, size):
+        item = pending_items.popleft()
+        status = "failed" if size is None else "skipped" if size == SKIPPED else "deduplicated" if size == DEDUPLICATED else "saved"
+        index_writer.writerow([item_type, item['id'], item['createdAt'], image_id, status])
+
+        progress["finished"] += 1
+        progress["failed"] = progress["failed"] or size is None
+        while page_ends and page_ends[0][0] <= progress["finished"]:
+            _, page_watermark = page_ends.popleft()
+            if manifest and not progress["failed"]:
+                manifest.set_checkpoint(item_type, timefrom, timeto, page_watermark)
+
+    try:
+        return apply_curl_to_items(settings["api_url"], image_ids(), settings["save_to_folder"], item_type,
+                                   settings["max_workers"], session, executor, manifest, on_done, archive, deduplicator,
+                                   settings["memory_budget"])
+    finally:
+        index_file.close()
+        if archive:
+            archive.close()
+
+def shard_index_path(settings, item_type, shard):
+    return os.path.join(settings["save_to_folder"], "index", f"{item_type}.shard-{shard:04d}.csv")
+
+def export_shard(shard, timefrom, timeto, settings):
+    # Runs in its own worker process when the range is sharded, so it opens its own session and manifest connection
+    max_workers = settings["max_workers"]
+    item_types = settings["item_types"]
+    session = create_session(max_workers, settings["graphql_url"])
+    manifest = ExportManifest(settings["manifest_path"]) if settings["manifest_path"] else None
+    deduplicator = ImageDeduplicator(settings["deduplicate_max_ids"]) if settings["deduplicate"] else None
+    totals = {"downloaded": 0, "skipped": 0, "deduplicated": 0, "failed": 0, "bytes": 0, "elapsed": 0.0}
+
+    try:
+        # Each object type is paged with its own query, and the object types are paged in parallel
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, ThreadPoolExecutor(max_workers=len(item_types)) as pagers:
+            futures = [pagers.submit(export_items, item_type, settings, timefrom, timeto, session, executor, manifest, shard, deduplicator)
+                       for item_type in item_types]
+            for future in futures:
+                stats = future.result()
+                for key in ("downloaded", "skipped", "deduplicated", "failed", "bytes"):
+                    totals[key] += stats[key]
+    finally:
+        if manifest:
+            manifest.close()
+        session.close()
+
+    return totals
+
+def read_index_rows(path, has_header):
+    with open(path, newline="") as index_file:
+        reader = csv.reader(index_file)
+        if has_header:
+            next(reader, None)
+        yield from reader
+
+def merge_shard_indexes(settings, shard_count):
+    # Shards cover consecutive time windows and each shard index is in (createdAt, id) order,
+    # so concatenating them in shard order gives the same index regardless of which shard finished first.
+    # A resumed run does not page the items before its checkpoints again, so this run's rows are merged
+    # into the index of earlier runs instead of replacing it. An item that is already in the index keeps
+    # its row, unless this run did more than skip it.
+    for item_type in settings["item_types"]:
+        merged_path = os.path.join(settings["save_to_folder"], f"{item_type}-index.csv")
+        shard_paths = [shard_index_path(settings, item_type, shard) for shard in range(shard_count)]
+        run_rows = itertools.chain.from_iterable(read_index_rows(shard_path, False) for shard_path in shard_paths)
+        earlier_rows = read_index_rows(merged_path, True) if os.path.exists(merged_path) else []
+
+        with open(merged_path + ".part", "w", newline="") as merged:
+            writer = csv.writer(merged)
+            writer.writerow(["item_type", "id", "createdAt", "imageDataId", "status"])
+            previous = None
+            # Earlier rows come first among equal keys, so a row of this run follows the row it replaces
+            for row in heapq.merge(earlier_rows, run_rows, key=lambda row: (row[2], row[1])):
+                if previous and previous[1:3] == row[1:3]:
+                    if row[4] != "skipped":
+                        previous = row
+                    continue
+                if previous:
+                    writer.writerow(previous)
+                previous = row
+            if previous:
+                writer.writerow(previous)
+
+        os.replace(merged_path + ".part", merged_path)
+        for shard_path in shard_paths:
+            os.remove(shard_path)
+        print(f"Index written: {merged_path}")
+
+def format_time(value):
+    return value.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+def split_time_range(timefrom, timeto, shards):
+    # Fixed-width windows; each window includes its start and excludes its end
+    start, end = parse_time(timefrom), parse_time(timeto)
+    width = (end - start) / shards
+    bounds = [format_time(start + width * i) for i in range(shards)] + [timeto]
+    bounds[0] = timefrom
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def count_items(item_type, client, timefrom, timeto):
+    query = build_count_query(item_type).replace('{timefrom}', timefrom).replace('{timeto}', timeto)
+    response_data = run_graphql_query(query, client)
+    if response_data is None or 'errors' in response_data:
+        return None
+    return response_data['data'][item_type]['totalCount']
+
+def split_time_range_adaptive(timefrom, timeto, shards, settings, slices_per_shard=8):
+    # Counts rows in narrow slices and groups consecutive slices so every shard gets a similar number of rows
+    slices = split_time_range(timefrom, timeto, shards * slices_per_shard)
+    counts = []
+    with create_session(1, settings["graphql_url"]) as client:
+        for slice_from, slice_to in slices:
+            slice_counts = [count_items(item_type, client, slice_from, slice_to) for item_type in settings["item_types"]]
+            if None in slice_counts:
+                print("Row counts are not available, falling back to fixed-width shards")
+                return split_time_range(timefrom, timeto, shards)
+            counts.append(sum(slice_counts))
+
+    target = max(sum(counts) / shards, 1)
+    windows = []
+    window_from, accumulated = timefrom, 0
+    for (slice_from, slice_to), count in zip(slices, counts):
+        accumulated += count
+        if accumulated >= target * (len(windows) + 1) and len(windows) < shards - 1:
+            windows.append((window_from, slice_to))
+            window_from = slice_to
+    windows.append((window_from, timeto))
+    return windows
+
+
+if __name__ == '__main__':
+    settings = {
+        "graphql_url": 'http://YOUR-URL:8097/graphql/',    # Replace with the actual GraphQL API endpoint URL
+        "api_url": 'http://YOUR-URL:8098/api/v1/Images',   # Replace with the actual API endpoint for image retrieval
+        "save_to_folder": "./images/",
+        "max_workers": 16,                                   # Maximum number of concurrent image downloads per shard
+        "pagination": "keyset",                              # "keyset" (createdAt/id watermark) or "offset" (take/skip)
+        "item_types": ["faces", "pedestrians", "genericObjects"],
+        "extra_fields": [],                                  # Additional fields to select, e.g. ["streamId"]
+        "memory_budget": 64 * 1024 * 1024,                   # Bytes of image data buffered in memory across all downloads of a shard
+        "deduplicate": True,                                 # Fetch every imageDataId once and link it from every entity that uses it
+        "deduplicate_max_ids": 1000000,                      # Fetched ids remembered for deduplication, roughly 350 bytes each
+        "archive_shard_size": None,                          # e.g. 1024 ** 3 packs images into 1 GB tar shards instead of single files
     }
-    '''
+    settings["manifest_path"] = os.path.join(settings["save_to_folder"], "manifest.sqlite")  # Set to None to always download everything
+    timefrom = "2025-10-16T00:00:00.000Z"                    # Replace with your DATETIME
+    timeto = "2025-10-16T23:59:59.000Z"                      # Replace with your DATETIME
+    shards = 1                                               # Number of worker processes the time range is split across
+    shard_mode = "fixed"                                     # "fixed" (equal-width windows) or "adaptive" (equal row counts)
 
     # Create main images folder
-    os.makedirs(save_to_folder, exist_ok=True)
-
-    # Fetch faces
-    print("Fetching faces...")
-    faces_items = fetch_items_with_pagination(query, 'faces', graphql_url, timefrom, timeto)
-    faces_image_ids = [item['imageDataId'] for item in faces_items]
-    print(f"Found {len(faces_image_ids)} faces")
-    if faces_image_ids:
-        apply_curl_to_items(api_url, faces_image_ids, save_to_folder, "faces")
-
-    # Fetch pedestrians
-    print("Fetching pedestrians...")
-    pedestrians_items = fetch_items_with_pagination(query, 'pedestrians', graphql_url, timefrom, timeto)
-    pedestrians_image_ids = [item['imageDataId'] for item in pedestrians_items]
-    print(f"Found {len(pedestrians_image_ids)} pedestrians")
-    if pedestrians_image_ids:
-        apply_curl_to_items(api_url, pedestrians_image_ids, save_to_folder, "pedestrians")
-
-    # Fetch genericObjects
-    print("Fetching generic objects...")
-    generic_objects_items = fetch_items_with_pagination(query, 'genericObjects', graphql_url, timefrom, timeto)
-    generic_objects_image_ids = [item['imageDataId'] for item in generic_objects_items]
-    print(f"Found {len(generic_objects_image_ids)} generic objects")
-    if generic_objects_image_ids:
-        apply_curl_to_items(api_url, generic_objects_image_ids, save_to_folder, "genericObjects")
+    os.makedirs(os.path.join(settings["save_to_folder"], "index"), exist_ok=True)
+    if settings["manifest_path"]:
+        # Create the manifest schema once before the workers open it
+        ExportManifest(settings["manifest_path"]).close()
+
+    totals = {"downloaded": 0, "skipped": 0, "deduplicated": 0, "failed": 0, "bytes": 0, "elapsed": 0.0}
+    start = time.perf_counter()
+
+    if shards > 1:
+        windows = split_time_range_adaptive(timefrom, timeto, shards, settings) if shard_mode == "adaptive" else split_time_range(timefrom, timeto, shards)
+        with ProcessPoolExecutor(max_workers=len(windows)) as workers:
+            futures = [workers.submit(export_shard, shard, window_from, window_to, settings)
+                       for shard, (window_from, window_to) in enumerate(windows)]
+            results = [future.result() for future in futures]
+    else:
+        windows = [(timefrom, timeto)]
+        results = [export_shard(0, timefrom, timeto, settings)]
+
+    for stats in results:
+        for key in ("downloaded", "skipped", "deduplicated", "failed", "bytes"):
+            totals[key] += stats[key]
+
+    merge_shard_indexes(settings, len(windows))
+    totals["elapsed"] = time.perf_counter() - start
+    print_throughput_summary("Total", totals)
@@ -1,34 +1,208 @@
-import requests
+import argparse
+import json
 import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# The shared SmartFace client lives next to the script folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from smartface_client import ImageArchive, SmartFaceClient, bounded_map, link_file, stream_to_archive, stream_to_file
+
+def apply_curl_to_items(api_url, image_data_ids, save_to_folder, archive=None, buffer_size=256 * 1024, client=None):
+    chunk_size = max(buffer_size // 2, 4096)
+
+    # One pooled client keeps the connection alive between images and retries failed requests
+    own_client = client is None
+    if own_client:
+        client = SmartFaceClient(rest_url=None)
+
+    # Faces of one tracklet (or of several members) can share an imageDataId; each image is fetched once
+    seen = set()
+    duplicates = 0
 
-def apply_curl_to_items(api_url, image_data_ids, save_to_folder):
     for image_id in image_data_ids:
+        if image_id in seen:
+            duplicates += 1
+            continue
+        seen.add(image_id)
+
         url = f"{api_url}/{image_id}"
         headers = {"accept": "image/jpeg"}
 
         try:
-            response = requests.get(url, headers=headers)
-
-            # Check if the request was successful (status code 200)
-            if response.status_code == 200:
-                # Save the image data to a file in the specified folder
-                file_path = os.path.join(save_to_folder, f"{image_id}.jpg")
-                with open(file_path, "wb") as file:
-                    file.write(response.content)
-                print(f"Image saved: {file_path}")
-            else:
-                print(f"Failed to retrieve image with id: {image_id}, Status code: {response.status_code}")
+            # The body is streamed in chunks, so at most about buffer_size bytes of it are held in memory
+            with client.get(url, headers=headers, stream=True) as response:
+
+                # Check if the request was successful (status code 200)
+                if response.status_code == 200:
+                    if archive:
+                        stream_to_archive(response, archive, image_id, chunk_size)
+                        print(f"Image packed: {image_id} -> {archive.shard_path}")
+                        continue
+
+                    # Save the image data to a file in the specified folder
+                    file_path = os.path.join(save_to_folder, f"{image_id}.jpg")
+                    stream_to_file(response, file_path, chunk_size)
+                    print(f"Image saved: {file_path}")
+                else:
+                    print(f"Failed to retrieve image with id: {image_id}, Status code: {response.status_code}")
 
         except requests.exceptions.RequestException as e:
             print(f"An error occurred while processing image with id: {image_id}, Error: {e}")
 
+    if own_client:
+        client.close()
+
+    print(f"{len(seen)} unique images, {duplicates} requests saved by deduplication")
+
+# Members of one batch of names, {take} and {skip} are filled in by the client while paging
+MEMBERS_QUERY = """
+query {
+  watchlistMembers(take: {take}, skip: {skip}, order: [{id:ASC}], where: {%s: {in: %s}}) {
+    items {
+      id
+      fullName
+      displayName
+      tracklet {
+        faces {
+          createdAt
+          faceType
+          imageDataId
+        }
+      }
+    }
+  }
+}
+"""
+
+def read_member_names(path):
+    # One name per line, empty lines and lines starting with # are skipped
+    with open(path, encoding="utf-8") as names_file:
+        return [line.strip() for line in names_file if line.strip() and not line.startswith("#")]
+
+def iter_members(client, names, match_field="displayName", batch_size=100, take=100):
+    # Resolves the names with one `in` query per batch_size names instead of one query per member
+    for start in range(0, len(names), batch_size):
+        query = MEMBERS_QUERY % (match_field, json.dumps(names[start:start + batch_size]))
+        yield from client.iter_graphql_items(query, "watchlistMembers", take)
+
+def member_folder_name(member, match_field, used_names):
+    name = re.sub(r'[<>:"/\\|?*\x00-\x1f]', "_", member.get(match_field) or "").strip(" .") or member["id"]
+    # Names do not have to be unique, a second member with the same name gets its id appended
+    if name in used_names:
+        name = f"{name}_{member['id']}"
+    used_names.add(name)
+    return name
+
+def save_image(client, api_url, image_id, file_path, chunk_size):
+    # Streams one image into file_path and returns the status code of the response
+    with client.get(f"{api_url}/{image_id}", headers={"accept": "image/jpeg"}, stream=True) as response:
+        if response.status_code == 200:
+            stream_to_file(response, file_path, chunk_size)
+        return response.status_code
+
+def export_members(api_url, names, save_to_folder, client, match_field="displayName", max_workers=16,
+                   buffer_size=256 * 1024, progress_interval=5):
+    # Downloads the tracklet faces of all named members into one folder per member. The members are
+    # resolved in batches while a single pool of max_workers downloads their images. An image shared
+    # by several members is downloaded once and linked into the other folders; images that are
+    # already in a folder from an earlier run are skipped.
+    chunk_size = max(buffer_size // 2, 4096)
+    stats = {"members": 0, "saved": 0, "skipped": 0, "linked": 0, "failed": 0}
+    found_names = set()
+    used_folder_names = set()
+    first_copies = {}   # image id -> path the image is downloaded to
+    duplicates = []     # (image id, path) of further copies, linked when all downloads are done
+    failed_ids = set()
+    started = time.perf_counter()
+
+    def jobs():
+        for member in iter_members(client, names, match_field):
+            stats["members"] += 1
+            found_names.add(member.get(match_field))
+            folder = os.path.join(save_to_folder, member_folder_name(member, match_field, used_folder_names))
+            os.makedirs(folder, exist_ok=True)
+            for face in (member.get("tracklet") or {}).get("faces") or []:
+                image_id = face.get("imageDataId")
+                if not image_id:
+                    continue
+                file_path = os.path.join(folder, f"{image_id}.jpg")
+                if image_id in first_copies:
+                    duplicates.append((image_id, file_path))
+                    continue
+                first_copies[image_id] = file_path
+                yield image_id, file_path
+
+    def download(job):
+        image_id, file_path = job
+        if os.path.exists(file_path):
+            return image_id, "skipped"
+        try:
+            status_code = save_image(client, api_url, image_id, file_path, chunk_size)
+        except requests.exceptions.RequestException as e:
+            return image_id, f"Error: {e}"
+        return image_id, "saved" if status_code == 200 else f"Status code: {status_code}"
+
+    last_progress = started
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for image_id, result in bounded_map(executor, download, jobs(), max_workers * 2):
+            if result in ("saved", "skipped"):
+                stats[result] += 1
+            else:
+                stats["failed"] += 1
+                failed_ids.add(image_id)
+                print(f"Failed to retrieve image with id: {image_id}, {result}")
+
+            if time.perf_counter() - last_progress >= progress_interval:
+                last_progress = time.perf_counter()
+                print(f"{stats['members']} members, {stats['saved'] + stats['skipped']} images so far")
+
+    for image_id, file_path in duplicates:
+        if image_id not in failed_ids and not os.path.exists(file_path):
+            link_file(first_copies[image_id], file_path)
+            stats["linked"] += 1
+
+    missing = [name for name in names if name not in found_names]
+    if missing:
+        print(f"{len(missing)} members not found: {', '.join(missing[:20])}{' ...' if len(missing) > 20 else ''}")
+
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    print(f"{stats['members']} members exported, {stats['saved']} images saved, {stats['skipped']} already exported, "
+          f"{stats['linked']} linked from other members, {stats['failed']} failed in {elapsed:.2f} s "
+          f"({stats['members'] / elapsed:.2f} members/s, {stats['saved'] / elapsed:.2f} images/s)")
+    return stats
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Downloads the face images of watchlist members")
+    parser.add_argument("--members", nargs="+", help="names of the members to export, each into its own folder")
+    parser.add_argument("--members-file", help="file with one member name per line")
+    parser.add_argument("--match", choices=["displayName", "fullName"], default="displayName", help="member field the names are compared with")
+    parser.add_argument("--workers", type=int, default=16, help="concurrent image downloads of the bulk export")
+    arguments = parser.parse_args()
+
     api_url = 'http://<enter-your-ip>:8098/api/v1/Images'  # Replace with the actual API endpoint for image retrieval
     save_to_folder = "./images/"                  
+    archive_shard_size = None   # e.g. 1024 ** 3 packs the images into 1 GB tar shards with an index instead of single files
 
     # GraphQL endpoint URL
     graphql_url = "http://<enter-your-ip>:8097/graphql/"
 
+    if arguments.members or arguments.members_file:
+        if archive_shard_size:
+            # The bulk export needs one folder per member to link shared images and to skip exported ones
+            print("archive_shard_size is not supported by the bulk export (--members, --members-file), set it to None")
+            sys.exit(1)
+        names = list(arguments.members or [])
+        if arguments.members_file:
+            names += read_member_names(arguments.members_file)
+        with SmartFaceClient(rest_url=None, graphql_url=graphql_url, pool_size=arguments.workers) as client:
+            export_members(api_url, list(dict.fromkeys(names)), save_to_folder, client, arguments.match, arguments.workers)
+        sys.exit()
+
     # GraphQL query
     query = """
     query{
@@ -53,8 +227,9 @@ if __name__ == '__main__':
     headers = {
         "Content-Type": "application/json",
     }
+    client = SmartFaceClient(rest_url=None, graphql_url=graphql_url)
     try:
-        response = requests.post(graphql_url, json={"query": query}, headers=headers)
+        response = client.post(graphql_url, json={"query": query}, headers=headers)
         response.raise_for_status()  # Check for HTTP errors
         data = response.json()
 
@@ -73,10 +248,20 @@ if __name__ == '__main__':
         print("Response content:", response.content)
         
         
+    archive = None
+    if archive_shard_size:
+        os.makedirs(save_to_folder, exist_ok=True)
+        archive = ImageArchive(save_to_folder, "images", archive_shard_size)
+
     try:
-        apply_curl_to_items(api_url, image_data_ids, save_to_folder)
+        apply_curl_to_items(api_url, image_data_ids, save_to_folder, archive, client=client)
         
     except requests.exceptions.RequestException as e:
         print("Error while downloading an image",e)
         print("Response content:", response.content)
+
+    finally:
+        if archive:
+            archive.close()
+        client.close()
         
\ No newline at end of file
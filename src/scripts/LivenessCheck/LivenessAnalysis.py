@@ -0,0 +1,131 @@
+import sys
+import os
+import csv
+import glob
+import math
+import pathlib
+
+from LivenessTest import labelFromName, spoofvalue_distantLivenessScoreThreshold
+
+SETUP_THRESHOLD_STEP = 1  # Distance between the swept thresholds, can be overridden with --step
+SETUP_MAX_SCORE = 100
+
+LOCALPATH = pathlib.Path(__file__).parent.resolve()
+
+
+def main():
+    args = sys.argv[1:]
+
+    print("Liveness Analysis")
+
+    if len(args) == 1 and (args[0] == '--help' or args[0] == '-h'):
+        print("\nSweeps the liveness threshold over the raw scores stored by LivenessTest.py, no server calls are made.")
+        print("Images are labelled as live or spoof by the folder inside the zip or the zip file name.\n")
+        print("LivenessAnalysis.py => analyse the newest log in the 'results' folder")
+        print("LivenessAnalysis.py results/log01.csv results/log02.csv => analyse the given logs together")
+        print("LivenessAnalysis.py --step 0.5 => distance between the swept thresholds (default " + str(SETUP_THRESHOLD_STEP) + ")")
+        print("LivenessAnalysis.py --output curve.csv => where to write the APCER/BPCER curve (default next to the first log)")
+        return
+
+    step = SETUP_THRESHOLD_STEP
+    if '--step' in args:
+        position = args.index('--step')
+        step = float(args[position + 1])
+        del args[position:position + 2]
+
+    output = None
+    if '--output' in args:
+        position = args.index('--output')
+        output = args[position + 1]
+        del args[position:position + 2]
+
+    logFiles = args
+    if not logFiles:
+        logFiles = sorted(glob.glob(str(LOCALPATH) + "/results/*.csv"), key=os.path.getmtime)
+        logFiles = [logFile for logFile in logFiles if not logFile.endswith(".curve.csv")][-1:]
+        if not logFiles:
+            print("\nNo logs to analyse in the 'results' folder.")
+            exit()
+
+    try:
+        import numpy as np
+    except ImportError:
+        print("The analysis needs the numpy package (pip3 install numpy).")
+        exit()
+
+    print("\nLogs to be analysed:\t" + str(logFiles))
+
+    scores, labels, skipped = readScores(logFiles)
+    liveScores = np.sort(np.asarray([score for score, label in zip(scores, labels) if label == "live"], dtype=float))
+    spoofScores = np.sort(np.asarray([score for score, label in zip(scores, labels) if label == "spoof"], dtype=float))
+
+    print("Live images: " + str(len(liveScores)) + ", spoof images: " + str(len(spoofScores)) +
+          ", skipped without a performed check, a numeric score or a label: " + str(skipped))
+    if len(liveScores) == 0 or len(spoofScores) == 0:
+        print("\nBoth live and spoof images with a score are needed to compute the error rates.")
+        exit()
+
+    thresholds, apcer, bpcer = sweepThresholds(np, liveScores, spoofScores, step)
+
+    # The equal error rate is taken where the two curves are closest to each other
+    eerIndex = int(np.argmin(np.abs(apcer - bpcer)))
+    print("\nEER: " + "{:.2f}".format((apcer[eerIndex] + bpcer[eerIndex]) / 2 * 100) +
+          "% at threshold " + "{:g}".format(thresholds[eerIndex]))
+
+    currentIndex = int(np.searchsorted(thresholds, spoofvalue_distantLivenessScoreThreshold))
+    if currentIndex < len(thresholds) and thresholds[currentIndex] == spoofvalue_distantLivenessScoreThreshold:
+        print("At the configured threshold " + str(spoofvalue_distantLivenessScoreThreshold) + ": APCER " +
+              "{:.2f}".format(apcer[currentIndex] * 100) + "%, BPCER " + "{:.2f}".format(bpcer[currentIndex] * 100) + "%")
+
+    if output is None:
+        output = os.path.splitext(logFiles[0])[0] + ".curve.csv"
+    with open(output, 'w', newline='') as curveFile:
+        curveWriter = csv.writer(curveFile, lineterminator="\n")
+        curveWriter.writerow(["THRESHOLD", "APCER", "BPCER"])
+        curveWriter.writerows(zip(thresholds.tolist(), apcer.tolist(), bpcer.tolist()))
+    print("\nCurve written to: " + output)
+
+
+def readScores(logFiles):
+    # Rows without a score (no face, failed request, liveness check not performed) or without a label cannot be used
+    scores = []
+    labels = []
+    skipped = 0
+
+    for logFile in logFiles:
+        with open(logFile, newline='') as LogTest:
+            # Logs from before the LABEL column are labelled by their zip name
+            for row in csv.DictReader(LogTest, skipinitialspace=True):
+                label = row.get("LABEL") or labelFromName(row["ZIPNAME"])
+                if not label or row.get("D_DIST_LVNS_PERFORMED") != "True":
+                    skipped += 1
+                    continue
+                # A performed check can still come without a score, which is logged as "None"
+                try:
+                    score = float(row.get("D_DIST_LVNS_SCORE"))
+                except (TypeError, ValueError):
+                    skipped += 1
+                    continue
+                if not math.isfinite(score):
+                    skipped += 1
+                    continue
+                scores.append(score)
+                labels.append(label)
+
+    return scores, labels, skipped
+
+
+def sweepThresholds(np, liveScores, spoofScores, step):
+    # An image passes as live when its score reaches the threshold. With sorted scores the number of
+    # images on each side of every threshold comes from one searchsorted call.
+    thresholds = np.union1d(np.arange(0, SETUP_MAX_SCORE + step, step), np.concatenate([liveScores, spoofScores]))
+
+    # APCER: attacks accepted as live, BPCER: live images rejected as spoof
+    apcer = (len(spoofScores) - np.searchsorted(spoofScores, thresholds, side='left')) / len(spoofScores)
+    bpcer = np.searchsorted(liveScores, thresholds, side='left') / len(liveScores)
+
+    return thresholds, apcer, bpcer
+
+
+if __name__ == "__main__":
+    main()
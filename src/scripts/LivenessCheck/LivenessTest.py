@@ -1,18 +1,36 @@
 import sys
 import os
+import csv
+import sqlite3
+import hashlib
 import glob
 import json
 import zipfile
 import datetime
 import base64
-import requests
 import time
 import pathlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# The shared SmartFace client lives next to the script folders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from smartface_client import SmartFaceClient, SmartFaceError
 
 SETUP_RESULTS_PREFIX = "DEFAULT"
 SETUP_RESTAPIURL = "http://localhost:8098"
 SETUP_RESTAPI = SETUP_RESTAPIURL + "/api/v1/Watchlists/Search"
 SETUP_TESTWATCHLIST = "CheckLivenessTest"
+SETUP_WORKERS = 8  # Maximum number of liveness requests in flight, can be overridden with --workers
+REQUEST_TIMEOUT = 120
+SETUP_WRITE_BATCH = 500  # Result rows buffered before they are written to the log
+SETUP_PROGRESS_INTERVAL = 5  # Seconds between progress lines on the console
+SETUP_PRINT_EACH_RESULT = False  # Print a line for every image (slow for large datasets), can be enabled with --verbose
+SETUP_COLUMNAR_OUTPUT = None  # "sqlite" or "parquet" writes the results there as well, can be set with --columnar
+SETUP_RESULT_CACHE = "result_cache.sqlite"  # Results of already checked images, None or --no-cache sends every image again
+SETUP_CACHE_MAX_ENTRIES = 500000  # Least recently used results are removed above this number
+SETUP_CACHE_COMMIT_INTERVAL = 2  # Seconds between cache commits at most, so a killed run loses only the last results
+CACHEABLE_CODES = ["200", "400"]  # Liveness results and images without a face do not change between runs
 
 spoofvalue_minFaceSize = 30
 spoofvalue_maxFaceSize = 600
@@ -20,6 +38,10 @@ spoofvalue_confidenceThreshold = 450
 spoofvalue_distantLivenessScoreThreshold = 90
 spoofvalue_distantLivenessConditions = "default"
 
+# Ground truth for LivenessAnalysis.py is taken from the folder inside the zip or from the zip file name
+SETUP_SPOOF_LABELS = ["spoof", "attack", "fake", "print", "replay", "mask"]
+SETUP_LIVE_LABELS = ["live", "genuine", "bonafide", "real"]
+
 LOCALPATH = pathlib.Path(__file__).parent.resolve()
 
 def main():
@@ -37,9 +59,35 @@ def main():
         print("\nPlease adjust the variables inside the script to set up your test. Additional options are possible:\n")
         print("LivenessTest.py --input input.zip => setup another input file using the local path")
         print("LivenessTest.py --input input01.zip input02.zip input03.zip => setup a list of additional zip input files using the local path")
+        print("LivenessTest.py --workers 16 => number of liveness requests sent in parallel (default " + str(SETUP_WORKERS) + ")")
+        print("LivenessTest.py --columnar sqlite => write the results into an SQLite database (or a Parquet file with parquet) next to the CSV log")
+        print("LivenessTest.py --verbose => print a line for every image instead of a periodic progress line")
+        print("LivenessTest.py --no-cache => send every image to the server, even if it was checked with the same settings before")
+
+    global SETUP_PRINT_EACH_RESULT
+    if '--verbose' in args:
+        SETUP_PRINT_EACH_RESULT = True
+        args.remove('--verbose')
+
+    resultCache = SETUP_RESULT_CACHE
+    if '--no-cache' in args:
+        resultCache = None
+        args.remove('--no-cache')
+
+    workers = SETUP_WORKERS
+    if '--workers' in args:
+        position = args.index('--workers')
+        workers = int(args[position + 1])
+        del args[position:position + 2]
+
+    columnar = SETUP_COLUMNAR_OUTPUT
+    if '--columnar' in args:
+        position = args.index('--columnar')
+        columnar = args[position + 1]
+        del args[position:position + 2]
 
     if len(args) > 1 and args[0] == '--input':
-        inputFiles = sys.argv[2:]
+        inputFiles = args[1:]
 
     if inputFiles:
         for item in inputFiles:
@@ -62,9 +110,10 @@ def main():
     else:
         print("\nZip files to be processed:\t"+str(ZIPLIST))
 
-        WatchlistIDSet = checkWatchlist()
+        session = createSession(workers)
+        WatchlistIDSet = checkWatchlist(session)
         if (not WatchlistIDSet):
-            WatchlistIDSet = createWatchlist()
+            WatchlistIDSet = createWatchlist(session)
         else:
             print(
                 "Watchlist for testing purposes exists, it will be used now: " + WatchlistIDSet)
@@ -75,197 +124,444 @@ def main():
         print("\nOutput file: " + str(LOGFILE_NAME) + "\n")
         startOverall = time.time()
         
-        with open(LOGFILE_NAME, 'a') as LogTest:
-            LogTest.write(
-                "ZIPNAME, IMAGE_FILE_NAME, FACE_QLT, FACE_SIZE, D_CODE, D_STATUS, D_DIST_LVNS_PERFORMED, D_DIST_LVNS_PASSED, D_DIST_LVNS_SCORE")
+        LogTest = ResultWriter(LOGFILE_NAME, columnar)
+        cache = ResultCache(str(localpath) + "/" + resultCache) if resultCache else None
+        try:
+            ImagesProcessed = checkZips(ZIPLIST, LogTest, WatchlistIDSet, workers, cache, session)
+        finally:
             LogTest.close()
-        
-        for ZIPITEM in ZIPLIST:
-            checkZip(ZIPITEM, LOGFILE_NAME, WatchlistIDSet)
+            if cache:
+                cache.close()
+            session.close()
 
         finishOverall = time.time()
         OverallTime = finishOverall - startOverall
         print("Total time to process: " + str(OverallTime))
+        print("Images processed: " + str(ImagesProcessed) + " (" +
+              "{:.2f}".format(ImagesProcessed / max(OverallTime, 1e-9)) + " images/s with " + str(workers) + " parallel requests)")
         print("\n\nThe script has ended successfully")
 
 
-def checkZip(fileInput, log, watchlistId):
-    print("Processing file:" + fileInput)
-    StartCurrent = time.time()
+RESULT_COLUMNS = ["ZIPNAME", "IMAGE_FILE_NAME", "FACE_QLT", "FACE_SIZE", "D_CODE", "D_STATUS",
+                  "D_DIST_LVNS_PERFORMED", "D_DIST_LVNS_PASSED", "D_DIST_LVNS_SCORE", "LABEL"]
+
+
+def labelFromName(name):
+    # Spoof keywords are checked first so that e.g. "live_spoof_attack" counts as an attack
+    name = name.lower()
+    for keyword in SETUP_SPOOF_LABELS:
+        if keyword in name:
+            return "spoof"
+    for keyword in SETUP_LIVE_LABELS:
+        if keyword in name:
+            return "live"
+    return ""
+
+
+class ResultWriter:
+    # Keeps the result files open for the whole run and writes rows in batches of SETUP_WRITE_BATCH.
+    # The CSV log is always written; columnar can add an SQLite database or a Parquet file next to it.
+
+    def __init__(self, csvPath, columnar=None):
+        self.batch = []
+        isNewFile = not os.path.exists(csvPath) or os.path.getsize(csvPath) == 0
+        self.csvFile = open(csvPath, 'a', newline='')
+        self.csvWriter = csv.writer(self.csvFile, lineterminator="\n")
+        if isNewFile:
+            self.csvWriter.writerow(RESULT_COLUMNS)
+
+        self.database = None
+        self.parquetWriter = None
+        basePath = os.path.splitext(csvPath)[0]
+
+        if columnar == "sqlite":
+            self.database = sqlite3.connect(basePath + ".sqlite")
+            self.database.execute("CREATE TABLE IF NOT EXISTS results (" +
+                                  ", ".join(column + " TEXT" for column in RESULT_COLUMNS) + ")")
+        elif columnar == "parquet":
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                print("Parquet output needs the pyarrow package (pip3 install pyarrow), only the CSV log will be written.")
+            else:
+                self.pyarrow = pyarrow
+                self.parquetSchema = pyarrow.schema([(column, pyarrow.string()) for column in RESULT_COLUMNS])
+                self.parquetWriter = pyarrow.parquet.ParquetWriter(basePath + ".parquet", self.parquetSchema)
+        elif columnar:
+            print("Unknown columnar output '" + columnar + "', only the CSV log will be written.")
+
+    def write(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= SETUP_WRITE_BATCH:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+
+        self.csvWriter.writerows(self.batch)
+        self.csvFile.flush()
+
+        if self.database:
+            self.database.executemany("INSERT INTO results VALUES (" + ", ".join("?" * len(RESULT_COLUMNS)) + ")", self.batch)
+            self.database.commit()
+
+        if self.parquetWriter:
+            columns = list(zip(*self.batch))
+            self.parquetWriter.write_table(self.pyarrow.table(
+                {column: list(values) for column, values in zip(RESULT_COLUMNS, columns)}, schema=self.parquetSchema))
+
+        self.batch = []
+
+    def close(self):
+        self.flush()
+        self.csvFile.close()
+        if self.database:
+            self.database.close()
+        if self.parquetWriter:
+            self.parquetWriter.close()
+
+
+class ProgressPrinter:
+    # Replaces the line per image with one summary line every SETUP_PROGRESS_INTERVAL seconds
+
+    def __init__(self):
+        self.start = time.time()
+        self.lastPrint = self.start
+        self.processed = 0
+        self.statusCounts = {}
+
+    def update(self, D_STATUS):
+        self.processed += 1
+        self.statusCounts[D_STATUS] = self.statusCounts.get(D_STATUS, 0) + 1
+
+        now = time.time()
+        if now - self.lastPrint >= SETUP_PROGRESS_INTERVAL:
+            self.lastPrint = now
+            self.show(now)
+
+    def show(self, now=None):
+        elapsed = (now or time.time()) - self.start
+        counts = ", ".join(status + ": " + str(count) for status, count in sorted(self.statusCounts.items()))
+        print("Processed " + str(self.processed) + " images (" + "{:.2f}".format(self.processed / max(elapsed, 1e-9)) +
+              " images/s) " + counts)
+
+
+class ResultCache:
+    # Parsed liveness results keyed by the SHA-256 of the image and of the request settings, so a rerun
+    # only sends new images or images checked with a different configuration. Results that depend on
+    # the server state (failed requests, time outs) are not cached. The least recently used entries
+    # are removed on every commit once the cache holds more than maxEntries results.
+
+    def __init__(self, path, maxEntries=SETUP_CACHE_MAX_ENTRIES):
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        self.pendingWrites = 0
+        self.configKey = cacheConfigKey()
+        self.database = sqlite3.connect(path)
+        self.database.execute("CREATE TABLE IF NOT EXISTS results (image_hash TEXT, config_hash TEXT, result TEXT, "
+                              "last_used REAL, PRIMARY KEY (image_hash, config_hash))")
+        self.database.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.entries = self.database.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        self.lastCommit = time.time()
+
+    def imageKey(self, image_data):
+        return hashlib.sha256(image_data).hexdigest()
+
+    def get(self, imageHash):
+        row = self.database.execute("SELECT result FROM results WHERE image_hash = ? AND config_hash = ?",
+                                    (imageHash, self.configKey)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.database.execute("UPDATE results SET last_used = ? WHERE image_hash = ? AND config_hash = ?",
+                              (time.time(), imageHash, self.configKey))
+        self.commitBatch()
+        return tuple(json.loads(row[0]))
+
+    def put(self, imageHash, result):
+        if result[2] not in CACHEABLE_CODES:
+            return
+        self.database.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                              (imageHash, self.configKey, json.dumps(list(result)), time.time()))
+        # Only results that were not found are stored, so this is a new row unless the same image was queued twice
+        self.entries += 1
+        self.commitBatch()
+
+    def commitBatch(self):
+        self.pendingWrites += 1
+        if self.pendingWrites >= SETUP_WRITE_BATCH or time.time() - self.lastCommit >= SETUP_CACHE_COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        if self.entries > self.maxEntries:
+            self.entries = self.database.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            excess = self.entries - self.maxEntries
+            if excess > 0:
+                self.database.execute("DELETE FROM results WHERE rowid IN "
+                                      "(SELECT rowid FROM results ORDER BY last_used LIMIT ?)", (excess,))
+                self.entries -= excess
+        self.database.commit()
+        self.pendingWrites = 0
+        self.lastCommit = time.time()
+
+    def close(self):
+        self.commit()
+        entries = self.database.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        self.database.close()
+
+        lookups = self.hits + self.misses
+        print("Result cache: " + str(self.hits) + " hits, " + str(self.misses) + " misses (" +
+              "{:.1f}".format(self.hits * 100 / max(lookups, 1)) + "% hit rate), " + str(entries) + " cached results")
+
+
+def cacheConfigKey():
+    # Everything in the request except the image and the watchlist changes the liveness result
+    settings = buildPostData("", None)
+    del settings["image"]
+    del settings["watchlistIds"]
+    settings["url"] = SETUP_RESTAPI
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def createSession(workers):
+    # One keep-alive connection per worker, shared by all zip files. Requests that fail on a busy
+    # server are retried by the client.
+    return SmartFaceClient(SETUP_RESTAPIURL, pool_size=workers, timeout=REQUEST_TIMEOUT)
+
+
+def buildPostData(encoded_string, watchlistId):
+    return {
+        "image": {
+            "data": encoded_string
+        },
+        "watchlistIds": [
+            watchlistId
+        ],
+        "threshold": 40,
+        "maxResultCount": 1,
+        "faceDetectorConfig": {
+            "minFaceSize": spoofvalue_minFaceSize,
+            "maxFaceSize": spoofvalue_maxFaceSize,
+            "maxFaces": 20,
+            "confidenceThreshold": spoofvalue_confidenceThreshold
+        },
+        "faceDetectorResourceId": "cpu",
+        "templateGeneratorResourceId": "cpu",
+        "faceMaskConfidenceRequest": {
+            "faceMaskThreshold": 3000
+        },
+        "faceFeaturesConfig": {
+            "age": 'false',
+            "gender": 'false',
+            "faceMask": 'true',
+            "noseTip": 'false',
+            "yawAngle": 'false',
+            "pitchAngle": 'false',
+            "rollAngle": 'false'
+        },
+        "spoofDetectorResourceIds": [
+            "liveness_distant_cpu_remote"
+        ],
+        "spoofCheckConfig": {
+            "distantLivenessScoreThreshold": spoofvalue_distantLivenessScoreThreshold,
+            "distantLivenessConditions": spoofvalue_distantLivenessConditions
+        }
 
-    print('{:<32s}{:<35s}{:<20s}{:<30s}{:<6s}{:<20s}{:<7s}{:<7s}{:<20s}'.format(
-        "ZIPNAME", "FILE_NAME", "FACEQLT", "FACESIZE", "CODE", "D_STATUS", "PERF", "PASSED", "SCORE"))
-    with zipfile.ZipFile(fileInput, mode='r') as ZipInput:
-        if (len(ZipInput.filelist) == 0):
-            print("\tThe ZIP file does not have any images present.")
-            exit()
+    }
+
+
+def checkImage(session, image_data, watchlistId):
+    # Returns FACE_QLT, FACE_SIZE, D_CODE, D_STATUS, D_DIST_LVNS_PERFORMED, D_DIST_LVNS_PASSED, D_DIST_LVNS_SCORE
+    encoded_string = base64.b64encode(image_data).decode('utf-8')
+    PostData = json.dumps(buildPostData(encoded_string, watchlistId))
+    PostHeaders = {'Accept': 'application/json',
+                   'Content-Type': 'application/json'}
+
+    try:
+        response = session.post(
+            SETUP_RESTAPI, data=PostData, headers=PostHeaders, timeout=REQUEST_TIMEOUT)
+        response_info = response.json() if response.status_code == 200 else None
+
+    except Exception as e:
+        print(
+            '\t\tERROR: POST Request failed. Could not do a liveness check. Reason: %s' % (e))
+        return "", "", "", "Request Failed", "", "", ""
+
+    D_CODE = response.status_code
+    FACE_QLT = ""
+    FACE_SIZE = ""
+
+    if (response.status_code == 200):
+
+        D_STATUS = "OK"
+
+        D_DIST_LVNS_PERFORMED = str(
+            response_info[0]['spoofCheckResult']['distantLivenessSpoofCheck']['performed'])
+        D_DIST_LVNS_PASSED = str(
+            response_info[0]['spoofCheckResult']['distantLivenessSpoofCheck']['passed'])
+        D_DIST_LVNS_SCORE = str(
+            response_info[0]['spoofCheckResult']['distantLivenessSpoofCheck']['score'])
+        FACE_QLT = str(response_info[0]['quality'])
+        FACE_SIZE = str(response_info[0]['faceSize'])
+
+        if (response_info[0]['spoofCheckResult']['distantLivenessSpoofCheck']['performed'] == False):
+            D_STATUS = "No check done"
         else:
+            if (response_info[0]['spoofCheckResult']['distantLivenessSpoofCheck']['passed'] == True):
+                D_STATUS = "Live"
+            elif (response_info[0]['spoofCheckResult']['distantLivenessSpoofCheck']['passed'] == False):
+                D_STATUS = "Spoof"
 
-            for file in ZipInput.filelist:
-
-                if (not file.is_dir()):
-
-                    IMAGE_FILE_NAME = file.filename.split("/")[-1]
-
-                    with ZipInput.open(file.filename, "r") as image_file:
-                        encoded_string = base64.b64encode(
-                            image_file.read()).decode('utf-8')
-
-                    PostData = {
-                        "image": {
-                            "data": encoded_string
-                        },
-                        "watchlistIds": [
-                            watchlistId
-                        ],
-                        "threshold": 40,
-                        "maxResultCount": 1,
-                        "faceDetectorConfig": {
-                            "minFaceSize": spoofvalue_minFaceSize,
-                            "maxFaceSize": spoofvalue_maxFaceSize,
-                            "maxFaces": 20,
-                            "confidenceThreshold": spoofvalue_confidenceThreshold
-                        },
-                        "faceDetectorResourceId": "cpu",
-                        "templateGeneratorResourceId": "cpu",
-                        "faceMaskConfidenceRequest": {
-                            "faceMaskThreshold": 3000
-                        },
-                        "faceFeaturesConfig": {
-                            "age": 'false',
-                            "gender": 'false',
-                            "faceMask": 'true',
-                            "noseTip": 'false',
-                            "yawAngle": 'false',
-                            "pitchAngle": 'false',
-                            "rollAngle": 'false'
-                        },
-                        "spoofDetectorResourceIds": [
-                            "liveness_distant_cpu_remote"
-                        ],
-                        "spoofCheckConfig": {
-                            "distantLivenessScoreThreshold": spoofvalue_distantLivenessScoreThreshold,
-                            "distantLivenessConditions": spoofvalue_distantLivenessConditions
-                        }
-
-                    }
-
-                    PostData = json.dumps(PostData)
-                    PostHeaders = {'Accept': 'application/json',
-                                   'Content-Type': 'application/json'}
-
-                    try:
-                        response = requests.post(
-                            SETUP_RESTAPI, data=PostData, headers=PostHeaders)
-                        response_info = response.json()
-
-                    except Exception as e:
-                        print(
-                            '\t\tERROR: POST Request failed. Could not do a liveness check. Reason: %s' % (e))
-
-                    finally:
-
-                        D_CODE = response.status_code
-                        FACE_QLT = ""
-                        FACE_SIZE = ""
-
-                        if (response.status_code == 200):
-
-                            D_STATUS = "OK"
-
-                            D_DIST_LVNS_PERFORMED = str(
-                                response_info[0]['spoofCheckResult']['distantLivenessSpoofCheck']['performed'])
-                            D_DIST_LVNS_PASSED = str(
-                                response_info[0]['spoofCheckResult']['distantLivenessSpoofCheck']['passed'])
-                            D_DIST_LVNS_SCORE = str(
-                                response_info[0]['spoofCheckResult']['distantLivenessSpoofCheck']['score'])
-                            FACE_QLT = str(response_info[0]['quality'])
-                            FACE_SIZE = str(response_info[0]['faceSize'])
-
-                            if (response_info[0]['spoofCheckResult']['distantLivenessSpoofCheck']['performed'] == False):
-                                D_STATUS = "No check done"
-                            else:
-                                if (response_info[0]['spoofCheckResult']['distantLivenessSpoofCheck']['passed'] == True):
-                                    D_STATUS = "Live"
-                                elif (response_info[0]['spoofCheckResult']['distantLivenessSpoofCheck']['passed'] == False):
-                                    D_STATUS = "Spoof"
-
-                        elif (response.status_code == 400):
-
-                            D_STATUS = "No face detected"
-                            D_DIST_LVNS_PERFORMED = ""
-                            D_DIST_LVNS_PASSED = ""
-                            D_DIST_LVNS_SCORE = ""
-                            FACE_QLT = "N/A"
-                            FACE_SIZE = "N/A"
-
-                        elif (response.status_code == 408):
-
-                            D_STATUS = "Request Time Out"
-                            D_DIST_LVNS_PERFORMED = ""
-                            D_DIST_LVNS_PASSED = ""
-                            D_DIST_LVNS_SCORE = ""
-
-                        else:
-                            D_STATUS = "Critical Error/Wrong Response"
-                            D_DIST_LVNS_PERFORMED = ""
-                            D_DIST_LVNS_PASSED = ""
-                            D_DIST_LVNS_SCORE = ""
-
-                        head, tail = os.path.split(fileInput)
-                        print('{:<32s}{:<35s}{:<20s}{:<30s}{:<6s}{:<20s}{:<7s}{:<7s}{:<20s}'.format(tail, IMAGE_FILE_NAME, FACE_QLT, FACE_SIZE, str(
-                            D_CODE), D_STATUS, D_DIST_LVNS_PERFORMED, D_DIST_LVNS_PASSED, str(D_DIST_LVNS_SCORE)))
-
-                        RUN_TIME = datetime.datetime.now()
-                        with open(log, 'a') as LogTest:
-                            LogTest.write("\n" + tail + "," + IMAGE_FILE_NAME+"," + FACE_QLT + "," + FACE_SIZE + "," + str(
-                                D_CODE) + ","+D_STATUS+","+D_DIST_LVNS_PERFORMED+","+D_DIST_LVNS_PASSED+","+str(D_DIST_LVNS_SCORE))
-
-    StopCurrent = time.time()
-    CurrentTotal = StopCurrent - StartCurrent
-    print("Time to process zip file: " + str(CurrentTotal))
-
-
-def checkWatchlist():
-
-    PageNumber = 1
-    PageSize = 10
-    foundWatchlist = False
+    elif (response.status_code == 400):
 
-    print("Searching for existig watchlist " + SETUP_TESTWATCHLIST)
+        D_STATUS = "No face detected"
+        D_DIST_LVNS_PERFORMED = ""
+        D_DIST_LVNS_PASSED = ""
+        D_DIST_LVNS_SCORE = ""
+        FACE_QLT = "N/A"
+        FACE_SIZE = "N/A"
 
-    while (foundWatchlist == False):
-        try:
-            checkWatchlistURL = SETUP_RESTAPIURL + "/api/v1/Watchlists/?PageNumber=" + \
-                str(PageNumber) + "&PageSize=" + str(PageSize)
+    elif (response.status_code == 408):
+
+        D_STATUS = "Request Time Out"
+        D_DIST_LVNS_PERFORMED = ""
+        D_DIST_LVNS_PASSED = ""
+        D_DIST_LVNS_SCORE = ""
 
-            response = requests.get(checkWatchlistURL)
-            response_info = response.json()
+    else:
+        D_STATUS = "Critical Error/Wrong Response"
+        D_DIST_LVNS_PERFORMED = ""
+        D_DIST_LVNS_PASSED = ""
+        D_DIST_LVNS_SCORE = ""
 
-        except Exception as e:
-            print('\t\tERROR: GET Request failed. Could not locate the test watchlist. Could not do a liveness check . Reason: %s' % (e))
+    return FACE_QLT, FACE_SIZE, str(D_CODE), D_STATUS, D_DIST_LVNS_PERFORMED, D_DIST_LVNS_PASSED, D_DIST_LVNS_SCORE
 
-        finally:
 
-            if (response.status_code == 200):
-                for item in response_info['items']:
-                    if (item['fullName'] == SETUP_TESTWATCHLIST):
-                        return item['id']
-                print("Page: " + str(PageNumber) +
-                      "> not found, trying in next set of " + str(PageSize))
-                if (response_info['nextPage'] != None):
-                    PageNumber += 1
+def readZipImages(fileInput, zipStats):
+    # Images are read one after another from a single thread; only the HTTP requests run in parallel
+    with zipfile.ZipFile(fileInput, mode='r') as ZipInput:
+        if (len(ZipInput.filelist) == 0):
+            print("\tThe ZIP file does not have any images present: " + fileInput)
+            return
+
+        for file in ZipInput.filelist:
+            if (not file.is_dir()):
+                if zipStats[fileInput]["start"] is None:
+                    zipStats[fileInput]["start"] = time.time()
+                zipStats[fileInput]["images"] += 1
+
+                IMAGE_FILE_NAME = file.filename.split("/")[-1]
+                LABEL = labelFromName(os.path.dirname(file.filename)) or labelFromName(os.path.basename(fileInput))
+                with ZipInput.open(file.filename, "r") as image_file:
+                    yield fileInput, IMAGE_FILE_NAME, LABEL, image_file.read()
+
+
+def checkZips(ZIPLIST, log, watchlistId, workers=SETUP_WORKERS, cache=None, session=None):
+    # Keeps up to `workers` liveness requests in flight across all zip files. Results are taken
+    # in submission order, so the log lists images in the same order as a sequential run.
+    # Cached results are queued as finished futures and keep their place in that order.
+    ownSession = session is None
+    if ownSession:
+        session = createSession(workers)
+    zipStats = {zipName: {"images": 0, "start": None, "finished": 0, "read": False} for zipName in ZIPLIST}
+    pending = deque()
+
+    progress = ProgressPrinter()
+
+    if SETUP_PRINT_EACH_RESULT:
+        print('{:<32s}{:<35s}{:<20s}{:<30s}{:<6s}{:<20s}{:<7s}{:<7s}{:<20s}'.format(
+            "ZIPNAME", "FILE_NAME", "FACEQLT", "FACESIZE", "CODE", "D_STATUS", "PERF", "PASSED", "SCORE"))
+
+    def writeResult(fileInput, IMAGE_FILE_NAME, LABEL, result):
+        FACE_QLT, FACE_SIZE, D_CODE, D_STATUS, D_DIST_LVNS_PERFORMED, D_DIST_LVNS_PASSED, D_DIST_LVNS_SCORE = result
+        head, tail = os.path.split(fileInput)
+        if SETUP_PRINT_EACH_RESULT:
+            print('{:<32s}{:<35s}{:<20s}{:<30s}{:<6s}{:<20s}{:<7s}{:<7s}{:<20s}'.format(tail, IMAGE_FILE_NAME, FACE_QLT, FACE_SIZE,
+                  D_CODE, D_STATUS, D_DIST_LVNS_PERFORMED, D_DIST_LVNS_PASSED, D_DIST_LVNS_SCORE))
+
+        log.write([tail, IMAGE_FILE_NAME] + list(result) + [LABEL])
+        progress.update(D_STATUS)
+
+        stats = zipStats[fileInput]
+        stats["finished"] += 1
+        if stats["read"] and stats["finished"] == stats["images"]:
+            CurrentTotal = time.time() - stats["start"]
+            print("Time to process zip file " + tail + ": " + str(CurrentTotal) + " (" +
+                  "{:.2f}".format(stats["images"] / max(CurrentTotal, 1e-9)) + " images/s)")
+
+    def drainOne():
+        fileInput, IMAGE_FILE_NAME, LABEL, imageHash, future = pending.popleft()
+        result = future.result()
+        if imageHash:
+            cache.put(imageHash, result)
+        writeResult(fileInput, IMAGE_FILE_NAME, LABEL, result)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for ZIPITEM in ZIPLIST:
+            print("Processing file:" + ZIPITEM)
+            for fileInput, IMAGE_FILE_NAME, LABEL, image_data in readZipImages(ZIPITEM, zipStats):
+                if len(pending) >= workers * 2:
+                    drainOne()
+
+                # imageHash is only kept for results that still have to be stored in the cache
+                imageHash = cache.imageKey(image_data) if cache else None
+                cached = cache.get(imageHash) if cache else None
+                if cached:
+                    future = Future()
+                    future.set_result(cached)
+                    imageHash = None
                 else:
-                    return False
-            elif (response.status_code == 404):
-                print("\nThe request was not valid.")
-                exit()
-            else:
-                print("Something went wrong.")
-                exit()
+                    future = executor.submit(checkImage, session, image_data, watchlistId)
+                pending.append((fileInput, IMAGE_FILE_NAME, LABEL, imageHash, future))
+            # A zip is reported once all of its images have been read and checked
+            zipStats[ZIPITEM]["read"] = True
+        while pending:
+            drainOne()
+
+    if ownSession:
+        session.close()
+    progress.show()
+    return sum(stats["images"] for stats in zipStats.values())
+
+
+def checkZip(fileInput, log, watchlistId):
+    LogTest = ResultWriter(log)
+    try:
+        checkZips([fileInput], LogTest, watchlistId)
+    finally:
+        LogTest.close()
+
+
+def checkWatchlist(session):
+
+    PageSize = 10
+
+    print("Searching for existig watchlist " + SETUP_TESTWATCHLIST)
+
+    try:
+        for item in session.iter_rest_items("/api/v1/Watchlists", page_size=PageSize):
+            if (item['fullName'] == SETUP_TESTWATCHLIST):
+                return item['id']
+        return False
+
+    except SmartFaceError as e:
+        if (e.status_code == 404):
+            print("\nThe request was not valid.")
+        else:
+            print("Something went wrong.")
+        exit()
+
+    except Exception as e:
+        print('\t\tERROR: GET Request failed. Could not locate the test watchlist. Could not do a liveness check . Reason: %s' % (e))
+        exit()
 
 
-def createWatchlist():
+def createWatchlist(session):
     print("Creating Watchlist>")
 
     PostData = {
@@ -279,8 +575,9 @@ def createWatchlist():
                    'Content-Type': 'application/json'}
 
     try:
-        response = requests.post(
-            SETUP_RESTAPIURL + "/api/v1/Watchlists", data=PostData, headers=PostHeaders)
+        # Not retried, a repeated request could create the watchlist twice
+        response = session.post(
+            "/api/v1/Watchlists", data=PostData, headers=PostHeaders, retries=0)
         response_info = response.json()
     except Exception as e:
         print(
@@ -1,10 +1,81 @@
-# pip install py-graphql-client
-# https://pypi.org/project/py-graphql-client/
+# pip install websockets
+# https://pypi.org/project/websockets/
 
-from graphql_client import GraphQLClient
+import argparse
+import asyncio
+import base64
+import concurrent.futures
+import contextlib
+import datetime
+import functools
+import hashlib
+import itertools
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
 
-def callback(_id, data):
-  print(f"msg id: {_id}. data: {data}")
+import websockets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+# GraphQL subscription endpoint of SmartFace
+graphql_ws_url = "ws://localhost:8097/graphql"
+
+# Received notifications wait in a bounded queue until a handler takes them.
+# "block" stops reading from the websocket while the queue is full, so the server buffers or slows down.
+# "drop-oldest" keeps reading and throws away the oldest waiting notification to make room.
+queue_size = 1000
+backpressure = "block"
+handler_workers = 1
+
+# Delay before reconnecting grows from reconnect_backoff up to max_reconnect_backoff seconds (with jitter)
+reconnect_backoff = 1.0
+max_reconnect_backoff = 30.0
+
+# How long the queued notifications may take to reach the handlers when the subscription is stopped
+drain_timeout = 5.0
+
+# Where the notifications are stored, any of "print", "jsonl", "sqlite", "webhook"
+sinks = ["print"]
+# Each sink writes a batch when it has sink_batch_size notifications or sink_flush_interval seconds passed
+sink_batch_size = 500
+sink_flush_interval = 1.0
+# Notifications waiting for a slow sink; when the sink falls further behind, the oldest ones are dropped
+sink_queue_size = 10000
+
+# A new JSONL file is started when the current one reaches jsonl_max_bytes, the full one gets a timestamp suffix
+jsonl_path = "notifications.jsonl"
+jsonl_max_bytes = 100 * 1024 * 1024
+sqlite_path = "notifications.sqlite"
+# Every batch is posted to the webhook as one JSON array
+webhook_url = "http://localhost:8080/notifications"
+webhook_timeout = 10
+
+# What happens with the crop images of the notifications:
+# "inline" - the base64 image stays in the notification
+# "store" - a background thread writes the image into crop_image_store, the notification gets "cropImageRef"
+#           (path of the image inside the store) instead. The same image is stored once.
+# "lazy" - cropImage is left out of the query, CropImageFetcher downloads the image of a notification on demand
+crop_images = "inline"
+crop_image_store = "crop_images"
+
+# APIs used by CropImageFetcher. The id of a match result is the id of the matched face; change the query
+# if your subscription delivers other items.
+rest_api_url = "http://localhost:8098"
+graphql_url = "http://localhost:8097/graphql"
+crop_image_query = """
+query ($id: UUID!) {
+  faces(where: {id: {eq: $id}}) {
+    items {
+      imageDataId
+    }
+  }
+}
+"""
 
 query = """
  subscription {
@@ -15,7 +86,7 @@ query = """
     watchlistFullName
     watchlistDisplayName
     previewColor
-    
+
     cropImage
     spoofCheck {
       performed
@@ -28,20 +99,459 @@ query = """
 
 """
 
-# Create a list to store subscription IDs
-subscription_ids = []
+# Message types of the two GraphQL over websocket protocols: graphql-transport-ws and the older graphql-ws
+PROTOCOL_MESSAGES = {
+    "graphql-transport-ws": {"subscribe": "subscribe", "data": "next", "stop": "complete"},
+    "graphql-ws": {"subscribe": "start", "data": "data", "stop": "stop"},
+}
 
-with GraphQLClient('ws://localhost:8097/graphql') as client:
+def callback(_id, data):
+  print(f"msg id: {_id}. data: {data}")
 
-    sub_id = client.subscribe(query, callback=callback)
-    subscription_ids.append(sub_id)
-    
-    try:
-        # Keep the script running
+class SubscriptionError(Exception):
+    pass
+
+class SubscriptionConsumer:
+    # Reads notifications of one subscription and hands them to handler workers through a bounded queue.
+    # Waiting on the socket and on the queue does not use the CPU. The handler runs on a thread unless it is
+    # a coroutine function, so slow handlers never block the websocket. A dropped connection is reopened
+    # and the subscription sent again.
+
+    def __init__(self, url, query, handler, queue_size=queue_size, backpressure=backpressure, workers=handler_workers,
+                 backoff=reconnect_backoff, max_backoff=max_reconnect_backoff):
+        if backpressure not in ("block", "drop-oldest"):
+            raise ValueError("backpressure must be 'block' or 'drop-oldest'")
+        self.url = url
+        self.query = query
+        self.handler = handler
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.backpressure = backpressure
+        self.workers = workers
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.subscription_ids = itertools.count(1)
+        self.stats = {"received": 0, "handled": 0, "dropped": 0, "failed": 0, "invalid": 0, "reconnects": 0}
+
+    async def run(self):
+        workers = [asyncio.create_task(self.handle_notifications()) for _ in range(self.workers)]
+        attempt = 0
+        try:
+            while True:
+                notifications = self.subscribe()
+                try:
+                    async for subscription_id, data in notifications:
+                        # The connection works again, the next failure starts with a short delay
+                        attempt = 0
+                        await self.enqueue((subscription_id, data))
+                    print("The subscription was completed by the server, subscribing again")
+                except (OSError, ValueError, KeyError, asyncio.TimeoutError, websockets.exceptions.WebSocketException, SubscriptionError) as e:
+                    print(f"Subscription connection failed: {e}")
+                finally:
+                    # Closes the connection right away, also when the consumer is cancelled
+                    await notifications.aclose()
+
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                attempt += 1
+                self.stats["reconnects"] += 1
+                print(f"Reconnecting in {delay:.1f} s")
+                await asyncio.sleep(delay)
+        finally:
+            # Gives the handlers a chance to take the notifications that are already queued
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+            for worker in workers:
+                worker.cancel()
+            print(f"Subscription stopped: {self.stats}")
+
+    def parse_message(self, raw_message):
+        # Returns the message as a dict, or None for a frame that is not a JSON object with a type
+        try:
+            message = json.loads(raw_message)
+        except ValueError:
+            message = None
+        if not isinstance(message, dict) or not isinstance(message.get("type"), str):
+            self.stats["invalid"] += 1
+            print(f"Skipping an invalid message: {str(raw_message)[:200]}")
+            return None
+        return message
+
+    async def subscribe(self):
+        # Yields (subscription id, data) for every notification of one connection
+        async with websockets.connect(self.url, subprotocols=list(PROTOCOL_MESSAGES)) as websocket:
+            messages = PROTOCOL_MESSAGES[websocket.subprotocol or "graphql-ws"]
+
+            await websocket.send(json.dumps({"type": "connection_init", "payload": {}}))
+            while True:
+                message = self.parse_message(await asyncio.wait_for(websocket.recv(), timeout=30))
+                if message is None:
+                    continue
+                if message["type"] == "connection_ack":
+                    break
+                if message["type"] == "connection_error":
+                    raise SubscriptionError(f"Connection refused: {message.get('payload')}")
+
+            subscription_id = str(next(self.subscription_ids))
+            await websocket.send(json.dumps({"id": subscription_id, "type": messages["subscribe"], "payload": {"query": self.query}}))
+            print(f"Subscribed as {subscription_id} using {websocket.subprotocol or 'graphql-ws'}")
+
+            try:
+                async for raw_message in websocket:
+                    message = self.parse_message(raw_message)
+                    if message is None:
+                        continue
+                    message_type = message["type"]
+                    if message_type == messages["data"]:
+                        payload = message.get("payload")
+                        if not isinstance(payload, dict):
+                            self.stats["invalid"] += 1
+                            print(f"Skipping a notification without a payload: {str(raw_message)[:200]}")
+                            continue
+                        yield message.get("id"), payload.get("data")
+                    elif message_type == "ping":
+                        await websocket.send(json.dumps({"type": "pong"}))
+                    elif message_type == "error":
+                        raise SubscriptionError(f"Subscription error: {message.get('payload')}")
+                    elif message_type == "complete":
+                        return
+                raise SubscriptionError("The server closed the connection")
+            finally:
+                with contextlib.suppress(websockets.exceptions.ConnectionClosed):
+                    await websocket.send(json.dumps({"id": subscription_id, "type": messages["stop"]}))
+
+    async def enqueue(self, notification):
+        self.stats["received"] += 1
+        if self.backpressure == "block":
+            await self.queue.put(notification)
+            return
+
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.queue.task_done()
+            self.stats["dropped"] += 1
+        self.queue.put_nowait(notification)
+
+    async def handle_notifications(self):
+        loop = asyncio.get_running_loop()
         while True:
-            pass
+            subscription_id, data = await self.queue.get()
+            try:
+                if asyncio.iscoroutinefunction(self.handler):
+                    await self.handler(subscription_id, data)
+                else:
+                    await loop.run_in_executor(None, functools.partial(self.handler, subscription_id, data))
+                self.stats["handled"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"The handler failed for a notification of subscription {subscription_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+def notification_fields(data):
+    # Root field (e.g. matchResult) and the item of a notification
+    if not data:
+        return None, {}
+    item_type, item = next(iter(data.items()))
+    return item_type, item or {}
+
+class PrintSink:
+    def write_batch(self, events):
+        for event in events:
+            callback(event["subscriptionId"], event["data"])
+
+    def close(self):
+        pass
+
+class JsonlSink:
+    # One notification per line, the file is rotated when it reaches max_bytes
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write_batch(self, events):
+        self.file.write("".join(json.dumps(event) + "\n" for event in events))
+        self.file.flush()
+        if self.file.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        name, extension = os.path.splitext(self.path)
+        os.replace(self.path, f"{name}.{datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{extension}")
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        self.file.close()
+
+class SqliteSink:
+    # One row per notification with the fields used for filtering and the whole notification as JSON
+    def __init__(self, path):
+        # The sink is created on the main thread and used by its writer thread
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS notifications (
+                id TEXT, type TEXT, stream_id TEXT, created_at TEXT, received_at TEXT, payload TEXT)
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS notifications_created_at ON notifications (created_at)")
+        self.connection.commit()
+
+    def write_batch(self, events):
+        rows = []
+        for event in events:
+            item_type, item = notification_fields(event["data"])
+            rows.append((item.get("id"), item_type, item.get("streamId"), item.get("createdAt"),
+                         event["receivedAt"], json.dumps(event["data"])))
+        with self.connection:
+            self.connection.executemany("INSERT INTO notifications VALUES (?, ?, ?, ?, ?, ?)", rows)
 
+    def close(self):
+        self.connection.close()
+
+class WebhookSink:
+    # Posts every batch as a JSON array. Failed posts are retried by the client, so the receiver
+    # may get a batch twice and should deduplicate by the notification id.
+    def __init__(self, url, timeout):
+        from smartface_client import SmartFaceClient
+
+        self.url = url
+        self.client = SmartFaceClient(rest_url=None, graphql_url=None, pool_size=1, timeout=timeout)
+
+    def write_batch(self, events):
+        response = self.client.post(self.url, json=events)
+        if response.status_code >= 400:
+            raise RuntimeError(f"the webhook answered with status code {response.status_code}")
+
+    def close(self):
+        self.client.close()
+
+def create_sinks(names):
+    factories = {
+        "print": PrintSink,
+        "jsonl": lambda: JsonlSink(jsonl_path, jsonl_max_bytes),
+        "sqlite": lambda: SqliteSink(sqlite_path),
+        "webhook": lambda: WebhookSink(webhook_url, webhook_timeout),
+    }
+    return {name: factories[name]() for name in names}
+
+# Put into a sink queue to make its writer flush and stop
+STOP = object()
+
+class SinkWriter:
+    # Collects the notifications of one sink and writes them in batches on the sink's own thread,
+    # so the event loop never waits for file, database or network I/O and a slow sink does not
+    # hold up the others. Notifications are added without waiting: when the sink falls more than
+    # queue_size behind, the oldest waiting ones are dropped.
+
+    def __init__(self, name, sink, batch_size=sink_batch_size, flush_interval=sink_flush_interval, queue_size=sink_queue_size):
+        self.name = name
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sink-{name}")
+        self.stats = {"written": 0, "batches": 0, "dropped": 0, "failed": 0}
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.write_batches())
+
+    def put(self, event):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.stats["dropped"] += 1
+        self.queue.put_nowait(event)
+
+    async def write_batches(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            event = await self.queue.get()
+            if event is STOP:
+                break
+            batch = [event]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                # Takes what is already queued without waiting, waits only for an incomplete batch
+                if self.queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        event = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    event = self.queue.get_nowait()
+                if event is STOP:
+                    stopping = True
+                    break
+                batch.append(event)
+            await self.write(batch)
+
+    async def write(self, batch):
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.sink.write_batch, batch)
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+        except Exception as e:
+            self.stats["failed"] += len(batch)
+            print(f"Sink {self.name} failed to write {len(batch)} notifications: {e}")
+
+    async def close(self):
+        # Writes the queued notifications, then closes the sink
+        await self.queue.put(STOP)
+        await self.task
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.sink.close)
+        self.executor.shutdown()
+        print(f"Sink {self.name} stopped: {self.stats}")
+
+class SinkDispatcher:
+    # Subscription handler that passes every notification to all sinks
+
+    def __init__(self, sinks, **writer_options):
+        self.writers = [SinkWriter(name, sink, **writer_options) for name, sink in sinks.items()]
+
+    def start(self):
+        for writer in self.writers:
+            writer.start()
+
+    async def dispatch(self, subscription_id, data):
+        event = {
+            "subscriptionId": subscription_id,
+            "receivedAt": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "data": data,
+        }
+        for writer in self.writers:
+            writer.put(event)
+
+    async def close(self):
+        for writer in self.writers:
+            await writer.close()
+
+def without_field(query, field):
+    # Removes a field that is written on its own line from a query
+    return re.sub(rf"^\s*{field}\s*\n", "", query, flags=re.MULTILINE)
+
+class CropImageStore:
+    # Content addressed file store: an image is saved as <first 2 characters of its SHA-256>/<SHA-256>.jpg,
+    # so an image that comes with several notifications is written once
+
+    def __init__(self, path):
+        self.path = path
+
+    def file_path(self, ref):
+        return os.path.join(self.path, *ref.split("/"))
+
+    def put(self, encoded):
+        # Saves a base64 encoded image and returns its reference
+        data = base64.b64decode(encoded)
+        digest = hashlib.sha256(data).hexdigest()
+        ref = f"{digest[:2]}/{digest}.jpg"
+        file_path = self.file_path(ref)
+        if not os.path.exists(file_path):
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            # Written under a temporary name, so a reader never sees half of an image
+            temp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, file_path)
+        return ref
+
+    def get(self, ref):
+        with open(self.file_path(ref), "rb") as f:
+            return f.read()
+
+class CropImageOffloader:
+    # Subscription handler that moves the crop image of every notification into a CropImageStore on a
+    # background thread and passes the notification with "cropImageRef" instead of "cropImage" to the next
+    # handler, a coroutine function like SinkDispatcher.dispatch. The sinks and the console then only see
+    # the small notification and the base64 string is released right away.
+
+    def __init__(self, store, handler):
+        self.store = store
+        self.handler = handler
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="crop-images")
+        self.stats = {"stored": 0, "failed": 0}
+
+    async def handle(self, subscription_id, data):
+        _, item = notification_fields(data)
+        encoded = item.pop("cropImage", None)
+        if encoded:
+            try:
+                item["cropImageRef"] = await asyncio.get_running_loop().run_in_executor(self.executor, self.store.put, encoded)
+                self.stats["stored"] += 1
+            except (OSError, ValueError) as e:
+                self.stats["failed"] += 1
+                print(f"Could not store the crop image of {item.get('id')}: {e}")
+        await self.handler(subscription_id, data)
+
+    def close(self):
+        self.executor.shutdown()
+        print(f"Crop images: {self.stats}")
+
+class CropImageFetcher:
+    # Downloads the crop image of a notification received without cropImage (crop_images = "lazy").
+    # Blocking; call it from a sync handler, which runs on a thread, or through run_in_executor.
+
+    def __init__(self, rest_url=rest_api_url, graphql_url=graphql_url, store=None):
+        from smartface_client import SmartFaceClient
+
+        self.client = SmartFaceClient(rest_url, graphql_url, pool_size=4)
+        self.store = store
+
+    def fetch(self, item):
+        # Image bytes, or None when SmartFace does not have the image (anymore)
+        faces = self.client.graphql(crop_image_query, {"id": item["id"]})["faces"]["items"]
+        if not faces or not faces[0].get("imageDataId"):
+            return None
+        response = self.client.get(f"/api/v1/Images/{faces[0]['imageDataId']}")
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.content
+
+    def fetch_to_store(self, item):
+        # Reference of the image in the store, see CropImageStore
+        data = self.fetch(item)
+        return self.store.put(base64.b64encode(data)) if data is not None else None
+
+    def close(self):
+        self.client.close()
+
+async def main(url, sink_names, crop_image_mode=crop_images):
+    dispatcher = SinkDispatcher(create_sinks(sink_names))
+    dispatcher.start()
+    handler = dispatcher.dispatch
+    subscription_query = query
+    offloader = None
+    if crop_image_mode == "store":
+        offloader = CropImageOffloader(CropImageStore(crop_image_store), handler)
+        handler = offloader.handle
+    elif crop_image_mode == "lazy":
+        subscription_query = without_field(query, "cropImage")
+
+    consumer = SubscriptionConsumer(url, subscription_query, handler)
+    try:
+        await consumer.run()
+    finally:
+        # Also on Ctrl+C: the queued notifications are written before the script ends
+        if offloader:
+            offloader.close()
+        await dispatcher.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Listens to a SmartFace GraphQL subscription and stores the notifications")
+    parser.add_argument("--url", default=graphql_ws_url, help="GraphQL subscription endpoint")
+    parser.add_argument("--sinks", nargs="+", default=sinks, choices=["print", "jsonl", "sqlite", "webhook"],
+                        help="where the notifications are stored")
+    parser.add_argument("--crop-images", default=crop_images, choices=["inline", "store", "lazy"],
+                        help="keep crop images in the notifications, move them into a file store or leave them out of the query")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(main(args.url, args.sinks, args.crop_images))
     except KeyboardInterrupt:
-        # Stop the subscriptions and gracefully exit on Ctrl+C
-        for sub_id in subscription_ids:
-            client.stop_subscribe(sub_id)
\ No newline at end of file
+        # Ctrl+C cancels the consumer, which stops the subscription, flushes the sinks and prints the counters
+        pass
@@ -0,0 +1,309 @@
+import argparse
+import base64
+import bisect
+import datetime
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+'''
+Local stand-in for the SmartFace REST and GraphQL APIs used by the Python scripts.
+
+Serves synthetic faces, pedestrians, generic objects and watchlist members with configurable
+latency, error rate and image size, so the scripts can be benchmarked without a SmartFace installation.
+Both APIs are served on one port; point the REST and GraphQL URLs of a script at it.
+'''
+
+DEFAULT_SETTINGS = {
+    "faces": 10000,                  # Number of synthetic items per object type
+    "pedestrians": 5000,
+    "genericObjects": 1000,
+    "members": 50,                   # Watchlist members, each with faces_per_member tracklet faces
+    "faces_per_member": 20,
+    "start": "2025-10-16T00:00:00.000Z",
+    "interval_ms": 500,              # Time between two consecutive items of one object type
+    "shared_images": 0.1,            # Fraction of pedestrians and objects pointing at the image of a face
+    "image_size": 20 * 1024,         # Bytes of every served image
+    "latency_ms": 0.0,               # Added to every request
+    "latency_jitter_ms": 0.0,        # Uniform random extra latency on top of latency_ms
+    "error_rate": 0.0,               # Fraction of requests answered with 503
+    "no_face_rate": 0.1,             # Fraction of probe images answered with 400 (no face detected)
+    "seed": 1,
+}
+
+ITEM_TYPES = ["faces", "pedestrians", "genericObjects"]
+
+def format_time(milliseconds):
+    value = datetime.datetime.fromtimestamp(milliseconds / 1000, datetime.timezone.utc)
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+def parse_time(value):
+    value = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return int(value.timestamp() * 1000)
+
+def score_of(data, salt=b""):
+    # Deterministic pseudo score 0-99 for a request body, so reruns give the same results
+    return int.from_bytes(hashlib.sha256(salt + data).digest()[:4], "big") % 100
+
+class SyntheticData:
+    # Every object type is a list sorted by (createdAt, id), like the order the scripts request.
+    # Pairs of items share a timestamp, so keyset pagination has to break ties on the id.
+
+    def __init__(self, settings):
+        self.settings = settings
+        start = parse_time(settings["start"])
+        self.items = {}
+        self.keys = {}
+
+        # Every share_every-th pedestrian and object refers to the image of a face, as a pedestrian and its face would
+        share_every = round(1 / settings["shared_images"]) if settings["shared_images"] and settings["faces"] else 0
+
+        for type_number, item_type in enumerate(ITEM_TYPES):
+            items = []
+            for i in range(settings[item_type]):
+                created_at = start + (i // 2) * settings["interval_ms"]
+                image_data_id = f"{type_number:02x}000000-0000-4000-8000-{i:012x}"
+                if item_type != "faces" and share_every and i % share_every == 0:
+                    image_data_id = f"00000000-0000-4000-8000-{i % settings['faces']:012x}"
+                items.append({
+                    "id": f"{type_number:02x}{i:06x}-0000-4000-8000-{i:012x}",
+                    "createdAt": format_time(created_at),
+                    "imageDataId": image_data_id,
+                    "streamId": f"{i % 4:08x}-0000-4000-8000-000000000000",
+                    "size": 40 + i % 10 * 10,
+                })
+            self.items[item_type] = items
+            self.keys[item_type] = [(parse_time(item["createdAt"]), item["id"]) for item in items]
+
+        self.members = []
+        for m in range(settings["members"]):
+            # The first member has the name the sample scripts look for
+            name = "Lucia" if m == 0 else f"Person {m}"
+            faces = [{"imageDataId": f"0a000000-0000-4000-8000-{m * settings['faces_per_member'] + f:012x}",
+                      "createdAt": format_time(start + f * 1000), "faceType": "Regular"}
+                     for f in range(settings["faces_per_member"])]
+            self.members.append({"id": f"0b000000-0000-4000-8000-{m:012x}", "displayName": name, "fullName": name,
+                                 "tracklet": {"faces": faces}})
+
+        self.watchlists = [{"id": "0c000000-0000-4000-8000-000000000000", "displayName": "Default", "fullName": "Default"}]
+        self.watchlists_lock = threading.Lock()
+
+        image = random.Random(settings["seed"]).randbytes(max(settings["image_size"] - 4, 0))
+        self.image_body = b"\xff\xd8" + image + b"\xff\xd9"
+
+    def select(self, item_type, time_from=None, time_to=None, after=None, min_size=None):
+        keys = self.keys[item_type]
+        low, high = 0, len(keys)
+        if time_from is not None:
+            low = bisect.bisect_left(keys, (time_from, ""))
+        if after is not None:
+            low = max(low, bisect.bisect_right(keys, after))
+        if time_to is not None:
+            high = bisect.bisect_left(keys, (time_to, ""))
+        items = self.items[item_type][low:high]
+        if min_size is not None:
+            items = [item for item in items if item["size"] > min_size]
+        return items
+
+def graphql_argument(pattern, query, cast=str):
+    match = re.search(pattern, query)
+    return cast(match.group(1)) if match else None
+
+def run_graphql(data, query):
+    # Understands the query shapes the scripts send: take/skip, createdAt ranges, the (createdAt, id)
+    # keyset filter, the face size filter, totalCount and watchlist members by name or list of names
+    root = graphql_argument(r"\{\s*(\w+)\s*[({]", query)
+
+    if root == "watchlistMembers":
+        name = graphql_argument(r'(?:fullName|displayName):\s*\{\s*eq:\s*"([^"]*)"', query)
+        names = graphql_argument(r'(?:fullName|displayName):\s*\{\s*in:\s*(\[[^\]]*\])', query, json.loads)
+        members = [member for member in data.members
+                   if (name is None or name in (member["fullName"], member["displayName"]))
+                   and (names is None or member["fullName"] in names or member["displayName"] in names)]
+        skip = graphql_argument(r"skip:\s*(\d+)", query, int) or 0
+        take = graphql_argument(r"take:\s*(\d+)", query, int)
+        page = members[skip:skip + take if take is not None else None]
+        return {"data": {root: {"items": page, "totalCount": len(members)}}}
+
+    if root not in ITEM_TYPES:
+        return {"errors": [{"message": f"The field '{root}' is not served by the stand-in server"}]}
+
+    time_from = graphql_argument(r'createdAt:\s*\{\s*gte:\s*"([^"]+)"', query, parse_time)
+    time_to = graphql_argument(r'createdAt:\s*\{\s*lt:\s*"([^"]+)"', query, parse_time)
+    after_time = graphql_argument(r'createdAt:\s*\{\s*gt:\s*"([^"]+)"', query, parse_time)
+    after_id = graphql_argument(r'id:\s*\{\s*gt:\s*"([^"]+)"', query)
+    min_size = graphql_argument(r"size:\s*\{\s*gt:\s*(\d+)", query, int)
+    after = (after_time, after_id or "") if after_time is not None else None
+
+    items = data.select(root, time_from, time_to, after, min_size)
+    result = {"totalCount": len(items)}
+
+    if re.search(r"items\s*\{", query):
+        skip = graphql_argument(r"skip:\s*(\d+)", query, int) or 0
+        take = graphql_argument(r"take:\s*(\d+)", query, int)
+        page = items[skip:skip + take if take is not None else None]
+        fields = re.findall(r"\w+", graphql_argument(r"items\s*\{([^{}]*)\}", query) or "")
+        result["items"] = [{field: item.get(field) for field in fields} for item in page]
+        result["pageInfo"] = {"hasNextPage": take is not None and skip + take < len(items)}
+
+    return {"data": {root: result}}
+
+def verify_response(probe, reference):
+    confidence = score_of(probe + reference, b"verify")
+    return {"confidence": confidence, "probeFaceDetails": {"faceSize": 50 + confidence}, "referenceFaceDetails": {"faceSize": 80}}
+
+def search_response(image, body):
+    score = score_of(image, b"liveness")
+    threshold = body.get("spoofCheckConfig", {}).get("distantLivenessScoreThreshold", 90)
+    return [{
+        "quality": 5000 + score * 10,
+        "faceSize": 60 + score,
+        "matchResults": [],
+        "spoofCheckResult": {"distantLivenessSpoofCheck": {"performed": True, "passed": score >= threshold, "score": score}},
+    }]
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without TCP_NODELAY the body waits for a delayed ACK
+    disable_nagle_algorithm = True
+    data = None
+    settings = DEFAULT_SETTINGS
+    random = random.Random(DEFAULT_SETTINGS["seed"])
+    random_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def simulate_server(self):
+        # Latency and errors are drawn from one seeded generator, so a run is reproducible
+        with self.random_lock:
+            delay = self.settings["latency_ms"] + self.random.uniform(0, self.settings["latency_jitter_ms"])
+            failed = self.random.random() < self.settings["error_rate"]
+        if delay:
+            time.sleep(delay / 1000)
+        if failed:
+            self.send_body(503, {"title": "Service Unavailable"})
+        return not failed
+
+    def no_face(self, image):
+        return score_of(image, b"face") < self.settings["no_face_rate"] * 100
+
+    def do_GET(self):
+        if not self.simulate_server():
+            return
+        url = urllib.parse.urlparse(self.path)
+
+        if url.path.startswith("/api/v1/Images/"):
+            image_id = url.path.rsplit("/", 1)[-1].encode("utf-8")
+            body = self.data.image_body
+            # The id is written right after the JPEG marker, so every image has different content
+            return self.send_body(200, body[:2] + image_id + body[2 + len(image_id):], "image/jpeg")
+
+        if url.path.rstrip("/") == "/api/v1/Watchlists":
+            query = dict(urllib.parse.parse_qsl(url.query))
+            page_number, page_size = int(query.get("PageNumber", 1)), int(query.get("PageSize", 10))
+            with self.data.watchlists_lock:
+                watchlists = list(self.data.watchlists)
+            items = watchlists[(page_number - 1) * page_size:page_number * page_size]
+            has_next = page_number * page_size < len(watchlists)
+            return self.send_body(200, {"items": items, "pageNumber": page_number, "pageSize": page_size,
+                                        "totalItemsCount": len(watchlists), "nextPage": f"{url.path}?PageNumber={page_number + 1}&PageSize={page_size}" if has_next else None})
+
+        self.send_body(404, {"title": "Not Found"})
+
+    def do_POST(self):
+        body = self.read_json()
+        if not self.simulate_server():
+            return
+        path = urllib.parse.urlparse(self.path).path.rstrip("/")
+
+        if path == "/graphql":
+            return self.send_body(200, run_graphql(self.data, body.get("query", "")))
+
+        if path == "/api/v1/Watchlists":
+            with self.data.watchlists_lock:
+                watchlist = {"id": f"0c000000-0000-4000-8000-{len(self.data.watchlists):012x}",
+                             "displayName": body.get("displayName"), "fullName": body.get("fullName")}
+                self.data.watchlists.append(watchlist)
+            return self.send_body(201, watchlist)
+
+        if path == "/api/v1/Watchlists/Search":
+            image = body.get("image", {}).get("data", "").encode("utf-8")
+            if self.no_face(image):
+                return self.send_body(400, {"title": "No face detected"})
+            return self.send_body(200, search_response(image, body))
+
+        if path == "/api/v1/Faces/Extract":
+            image = body.get("image", {}).get("data", "").encode("utf-8")
+            template = base64.b64encode(hashlib.sha512(image).digest()).decode("utf-8")
+            return self.send_body(200, [{"template": template, "faceSize": 80}])
+
+        if path in ("/api/v1/Faces/Verify", "/api/v1/Faces/VerifyTemplate"):
+            probe = body.get("probeImage", {}).get("image", {}).get("data", "").encode("utf-8")
+            reference = body.get("referenceImage", {}).get("image", {}).get("data") or body.get("referenceTemplate", {}).get("data", "")
+            if self.no_face(probe):
+                return self.send_body(400, {"title": "No face detected"})
+            return self.send_body(200, verify_response(probe, reference.encode("utf-8")))
+
+        self.send_body(404, {"title": "Not Found"})
+
+def create_server(host="127.0.0.1", port=8098, **overrides):
+    # Returns a server that is not running yet; call serve_forever(), e.g. on a thread
+    settings = dict(DEFAULT_SETTINGS, **overrides)
+    handler = type("Handler", (StandInHandler,), {
+        "data": SyntheticData(settings),
+        "settings": settings,
+        "random": random.Random(settings["seed"]),
+        "random_lock": threading.Lock(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def start_server(host="127.0.0.1", port=0, **overrides):
+    # Runs the server on a background thread; port 0 picks a free port (see server.server_address)
+    server = create_server(host, port, **overrides)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Local stand-in for the SmartFace REST and GraphQL APIs.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8098, help="port for both the REST API and /graphql")
+    for name, value in DEFAULT_SETTINGS.items():
+        parser.add_argument("--" + name.replace("_", "-"), dest=name, type=type(value), default=value)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    arguments = vars(parse_arguments())
+    host, port = arguments.pop("host"), arguments.pop("port")
+    server = create_server(host, port, **arguments)
+
+    print(f"SmartFace stand-in listening on http://{host}:{port} (REST) and http://{host}:{port}/graphql")
+    for name, value in arguments.items():
+        print(f"{name}: {value}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -1,8 +1,13 @@
+import bisect
+import heapq
 import http.server
-import socketserver
+import itertools
+import json
+import random
+import re
 import threading
 import time
-import json
+import urllib.parse
 
 
 # Open the JSON file for reading
@@ -21,6 +26,10 @@ timeDelay = data['timeDelay']
 binding_ip = data['binding_ip']
 binding_port = data['binding_port']
 checkInterval = data['checkInterval']
+# Optional delays of single gates, e.g. {"entrance": 3, "exit": 5}; other gates use timeDelay
+gateDelays = data.get('gates', {})
+# Fraction of requests and light changes written to the console, e.g. 0.01; 0 logs only errors
+debugLogSampleRate = data.get('debugLogSampleRate', 0)
 
 print("Traffic Light")
 print()
@@ -29,6 +38,9 @@ print("Time Delay: " + str(timeDelay))
 print("Binding Ip: " + binding_ip)
 print("Binding Port: " + str(binding_port))
 print("Check Interval: " + str(checkInterval))
+for gateName, gateDelay in gateDelays.items():
+    print("Gate " + gateName + " Time Delay: " + str(gateDelay))
+print("Debug Log Sample Rate: " + str(debugLogSampleRate))
 
 
 
@@ -44,128 +56,422 @@ html_page = """
     <div id="content"></div>
 
     <script>
+        // The page of a gate is served on /<gate>, the page on / shows the default gate
+        const gate = window.location.pathname.substring(1);
+        document.title = 'Traffic Light ' + gate;
+
+        // Update the content of the 'data' div with the status
+        function showStatus(data) {{
+            document.getElementById('content').textContent = data;
+            if(data == 'green')
+            {{
+                document.body.style.backgroundColor = 'green'
+            }}
+            else
+            {{
+                document.body.style.backgroundColor = 'red'
+            }}
+        }}
+
         // Function to fetch and update data from the /status endpoint
         function fetchData() {{
-            fetch('http://{}:{}' + '/status') // Replace with your actual endpoint URL
+            fetch('http://{0}:{1}' + '/status/' + gate) // Replace with your actual endpoint URL
                 .then(response => response.text())
-                .then(data => {{
-                    // Update the content of the 'data' div with the fetched data
-                    document.getElementById('content').textContent = data;
-                    if(data == 'green')
-                    {{
-                        document.body.style.backgroundColor = 'green'
-                    }}
-                    else
-                    {{
-                        document.body.style.backgroundColor = 'red'
-                    }}
-                }})
+                .then(showStatus)
                 .catch(error => console.error('Error:', error));
         }}
 
-        // Periodically fetch data
-        setInterval(fetchData, {}); // Adjust the interval as needed (in milliseconds)
-        
-        // Initial data fetch
-        fetchData();
+        if (window.EventSource) {{
+            // The server sends the status right away and then every change of it
+            const events = new EventSource('http://{0}:{1}' + '/events/' + gate);
+            events.onmessage = event => showStatus(event.data);
+            // Red while the connection is lost, the browser reconnects by itself
+            events.onerror = () => showStatus('red');
+        }}
+        else {{
+            // Periodically fetch data
+            setInterval(fetchData, {2}); // Adjust the interval as needed (in milliseconds)
+
+            // Initial data fetch
+            fetchData();
+        }}
     </script>
 </html>
 """.format(binding_ip, binding_port, checkInterval)
 
-status = "red"
-startTimer : time
+# Seconds between keep-alive comments on the /events stream, they also detect displays that went away
+keepAliveInterval = 15
+
+def debug_log(message):
+    # Per request output is sampled, printing every poll costs more than serving it
+    if debugLogSampleRate and random.random() < debugLogSampleRate:
+        print(message)
+
+class Histogram:
+    # Prometheus style histogram, the caller holds the lock of Metrics
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        separator = "," if labels else ""
+        labelBlock = "{" + labels + "}" if labels else ""
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}'
+        yield f"{name}_sum{labelBlock} {self.sum}"
+        yield f"{name}_count{labelBlock} {cumulative}"
+
+class Metrics:
+    # Counters of the server, served on /metrics in the Prometheus text format
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.durations = {}
+        self.greenDelivery = Histogram()
+        self.displays = 0
+
+    def observe_request(self, method, endpoint, code, duration):
+        with self.lock:
+            key = (method, endpoint, code)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            # An /events request lasts as long as the display is connected, it is not a latency
+            if endpoint != 'events':
+                self.durations.setdefault(endpoint, Histogram()).observe(duration)
+
+    def observe_green_delivery(self, seconds):
+        with self.lock:
+            self.greenDelivery.observe(seconds)
+
+    def display_connected(self, change):
+        with self.lock:
+            self.displays += change
+
+    def render(self):
+        with gates_lock:
+            gateCount = len(gates)
+        with self.lock:
+            lines = ["# HELP trafficlight_requests_total Handled requests.", "# TYPE trafficlight_requests_total counter"]
+            for (method, endpoint, code), count in sorted(self.requests.items()):
+                lines.append(f'trafficlight_requests_total{{method="{method}",endpoint="{endpoint}",code="{code}"}} {count}')
+            lines += ["# HELP trafficlight_request_duration_seconds Time to handle a request.",
+                      "# TYPE trafficlight_request_duration_seconds histogram"]
+            for endpoint, histogram in sorted(self.durations.items()):
+                lines += histogram.lines("trafficlight_request_duration_seconds", f'endpoint="{endpoint}"')
+            lines += ["# HELP trafficlight_green_delivery_seconds Time from /go until the green light was sent to a connected display.",
+                      "# TYPE trafficlight_green_delivery_seconds histogram"]
+            lines += self.greenDelivery.lines("trafficlight_green_delivery_seconds", "")
+            lines += ["# HELP trafficlight_displays_connected Displays connected to /events.",
+                      "# TYPE trafficlight_displays_connected gauge",
+                      f"trafficlight_displays_connected {self.displays}",
+                      "# HELP trafficlight_gates Gates known to the server.",
+                      "# TYPE trafficlight_gates gauge",
+                      f"trafficlight_gates {gateCount}"]
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+# Gate used by /go, /status and /events without a gate name
+defaultGate = "default"
+# Letters, digits, "_", "." and "-", but not "." or ".." alone
+gateNamePattern = re.compile(r"^(?!\.{1,2}$)[A-Za-z0-9_.-]{1,64}$")
+
+class Gate:
+    # One traffic light. lock guards status, version and changedAt; version grows with every change and
+    # the /events streams of the gate wait on changed for it.
+
+    def __init__(self, name, timeDelay):
+        self.name = name
+        self.timeDelay = timeDelay
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.status = "red"
+        self.version = 0
+        self.changedAt = time.monotonic()
+
+    def set_status(self, newStatus):
+        # Call with lock held
+        self.status = newStatus
+        self.version += 1
+        self.changedAt = time.monotonic()
+        self.changed.notify_all()
+
+    def go(self):
+        with self.lock:
+            self.set_status("green")
+            # Another /go while green moves the deadline, the earlier one is skipped by its old version
+            scheduler.schedule(time.monotonic() + self.timeDelay, self, self.version)
+
+    def expire(self, version):
+        with self.lock:
+            if self.version == version:
+                debug_log("status " + self.name + ": red")
+                self.set_status("red")
+
+    def current_status(self):
+        with self.lock:
+            return self.status
+
+    def wait_for_change(self, version, timeout):
+        # Waits until the state is newer than version (or the timeout passes) and returns the current
+        # version, status and the time of the last change
+        with self.lock:
+            self.changed.wait_for(lambda: self.version != version, timeout)
+            return self.version, self.status, self.changedAt
+
+class ExpiryScheduler:
+    # Turns the lights red when their delay runs out. One thread waits for the earliest deadline in a heap,
+    # so a /go costs O(log n) and nothing scans the gates. Deadlines replaced by a later /go stay in the heap
+    # until they are due and are then skipped.
+
+    def __init__(self):
+        self.heap = []
+        self.condition = threading.Condition()
+        self.sequence = itertools.count()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def schedule(self, deadline, gate, version):
+        with self.condition:
+            entry = (deadline, next(self.sequence), gate, version)
+            heapq.heappush(self.heap, entry)
+            # Only a new earliest deadline changes how long the thread has to wait
+            if self.heap[0] is entry:
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.heap or self.heap[0][0] > time.monotonic():
+                    self.condition.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                _, _, gate, version = heapq.heappop(self.heap)
+            gate.expire(version)
+
+scheduler = ExpiryScheduler()
+scheduler.start()
+
+# Gates are created by their first /go or from the config; reading an unknown gate does not store it,
+# so typos and scanners cannot grow the server state. gateWaiters holds an event per gate name that
+# connected displays wait for, only as long as they are connected.
+gates = {}
+gates_lock = threading.Lock()
+gateWaiters = {}  # name -> [threading.Event, number of waiting displays]
+
+def find_gate(name):
+    with gates_lock:
+        return gates.get(name)
+
+def create_gate(name):
+    with gates_lock:
+        gate = gates.get(name)
+        if gate is None:
+            gate = gates[name] = Gate(name, gateDelays.get(name, timeDelay))
+            waiter = gateWaiters.pop(name, None)
+            if waiter:
+                waiter[0].set()
+        return gate
+
+def wait_for_gate(name, timeout):
+    # The gate once it exists, None if it was not created within the timeout
+    with gates_lock:
+        if name in gates:
+            return gates[name]
+        waiter = gateWaiters.setdefault(name, [threading.Event(), 0])
+        waiter[1] += 1
+
+    waiter[0].wait(timeout)
+
+    with gates_lock:
+        waiter[1] -= 1
+        if waiter[1] == 0 and gateWaiters.get(name) is waiter:
+            del gateWaiters[name]
+        return gates.get(name)
+
+for gateName in [defaultGate, *gateDelays]:
+    create_gate(gateName)
+
+def parse_path(path):
+    # "/status/entrance" -> ("status", "entrance"), "/status" -> ("status", defaultGate)
+    parts = urllib.parse.urlsplit(path).path.strip('/').split('/')
+    gateName = parts[1] if len(parts) > 1 and parts[1] else defaultGate
+    return parts[0], gateName
 
 class MyHandler(http.server.SimpleHTTPRequestHandler):
+    # Keep-alive connections, so polling displays do not open a new connection for every request
+    protocol_version = "HTTP/1.1"
+    # Idle keep-alive connections are closed after this many seconds and free their thread
+    timeout = 60
+
+    def send_response(self, code, message=None):
+        self.statusCode = code
+        super().send_response(code, message)
+
+    def log_request(self, code='-', size='-'):
+        # Errors are still logged by log_error
+        if debugLogSampleRate and random.random() < debugLogSampleRate:
+            super().log_request(code, size)
+
+    def send_text(self, text, contentType='text/html'):
+        body = text.encode()
+        self.send_response(200)
+        self.send_header('Content-type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')  # Allow requests from any origin
+        self.send_header('Access-Control-Allow-Methods', 'GET')  # Allow GET requests
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')  # Allow Content-Type header
+        self.end_headers()
+        self.wfile.write(body)
+
+    def valid_gate_name(self, gateName):
+        if not gateNamePattern.match(gateName):
+            self.send_error(404, "Invalid gate name")
+            return False
+        return True
+
+    def measured(self, handler):
+        # Counts the request and its duration by method, endpoint and status code
+        started = time.perf_counter()
+        self.statusCode = None
+        endpoint = handler()
+        metrics.observe_request(self.command, endpoint, self.statusCode, time.perf_counter() - started)
+
+    def discard_body(self):
+        # On a keep-alive connection an unread body would be parsed as the start of the next request
+        if self.headers.get('Transfer-Encoding'):
+            self.close_connection = True
+            return
+        try:
+            remaining = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            self.close_connection = True
+            return
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 64 * 1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+
     def do_GET(self):
-        global status
-        global startTimer
-        global timeDelay
-        global html_page
-               
-        if self.path == '/go':
-            print("go GET")
-            status = "green" 
-            startTimer = time.time()
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.send_header('Access-Control-Allow-Origin', '*')  # Allow requests from any origin
-            self.send_header('Access-Control-Allow-Methods', 'GET')  # Allow GET requests
-            self.send_header('Access-Control-Allow-Headers', 'Content-Type')  # Allow Content-Type header
-            self.end_headers()
-            messageToBeSent = "GO! signal for the next {timeDelay} seconds."
-            self.wfile.write(messageToBeSent.encode())
-            
-        elif self.path == '/status':
-            
-            currentTimer = time.time()
-            
-            if(status == "green"):
-                diffTimer = currentTimer - startTimer
-                print("diffTimer:" +str(diffTimer))
-                
-                if(diffTimer > timeDelay):
-                    status = "red"
-                    diffTimer = 0
-            
-            print("status: " + status)
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.send_header('Access-Control-Allow-Origin', '*')  # Allow requests from any origin
-            self.send_header('Access-Control-Allow-Methods', 'GET')  # Allow GET requests
-            self.send_header('Access-Control-Allow-Headers', 'Content-Type')  # Allow Content-Type header
-            self.end_headers()
-            self.wfile.write(status.encode())
+        self.discard_body()
+        self.measured(self.handle_get)
 
-        else:
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.send_header('Access-Control-Allow-Origin', '*')  # Allow requests from any origin
-            self.send_header('Access-Control-Allow-Methods', 'GET')  # Allow GET requests
-            self.send_header('Access-Control-Allow-Headers', 'Content-Type')  # Allow Content-Type header
-            self.end_headers()
-            self.wfile.write(html_page.encode())
-    
     def do_POST(self):
-        global status
-        global startTimer
-        global timeDelay
-        global html_page
-               
-        if self.path == '/go':
-            print("go POST")
-            status = "green" 
-            startTimer = time.time()
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.send_header('Access-Control-Allow-Origin', '*')  # Allow requests from any origin
-            self.send_header('Access-Control-Allow-Methods', 'GET')  # Allow GET requests
-            self.send_header('Access-Control-Allow-Headers', 'Content-Type')  # Allow Content-Type header
-            self.end_headers()
-            messageToBeSent = "GO! signal for the next {timeDelay} seconds."
-            self.wfile.write(messageToBeSent.encode())
-            
+        # Cameras and webhooks may post a payload to /go, it is not used
+        self.discard_body()
+        self.measured(self.handle_post)
+
+    def handle_get(self):
+        action, gateName = parse_path(self.path)
+
+        if action in ('go', 'status', 'events'):
+            if not self.valid_gate_name(gateName):
+                return action
+
+            if action == 'go':
+                gate = create_gate(gateName)
+                debug_log("go GET " + gate.name)
+                gate.go()
+                self.send_text(f"GO! signal for the next {gate.timeDelay} seconds.")
+
+            elif action == 'status':
+                # A gate without any /go yet is red
+                gate = find_gate(gateName)
+                currentStatus = gate.current_status() if gate else "red"
+                debug_log("status " + gateName + ": " + currentStatus)
+                self.send_text(currentStatus)
+
+            else:
+                self.send_events(gateName)
+            return action
+
+        elif action == 'metrics':
+            self.send_text(metrics.render(), 'text/plain; version=0.0.4')
+            return action
+
+        else:
+            self.send_text(html_page)
+            return 'page'
+
+    def send_events(self, gateName):
+        # Server-Sent Events: the current status and then every change, until the display disconnects
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.send_header('Access-Control-Allow-Origin', '*')  # Allow requests from any origin
+        self.end_headers()
+        self.close_connection = True
+        debug_log("display connected to " + gateName)
+        metrics.display_connected(1)
+
+        try:
+            gate = find_gate(gateName)
+            if gate is None:
+                # Red until the first /go creates the gate
+                self.wfile.write(b"data: red\n\n")
+                while gate is None:
+                    gate = wait_for_gate(gateName, keepAliveInterval)
+                    if gate is None:
+                        self.wfile.write(b": keep-alive\n\n")
+
+            version, currentStatus, _ = gate.wait_for_change(-1, 0)
+            while True:
+                self.wfile.write(f"data: {currentStatus}\n\n".encode())
+                newVersion, currentStatus, changedAt = gate.wait_for_change(version, keepAliveInterval)
+                while newVersion == version:
+                    self.wfile.write(b": keep-alive\n\n")
+                    newVersion, currentStatus, changedAt = gate.wait_for_change(version, keepAliveInterval)
+                version = newVersion
+                if currentStatus == "green":
+                    # Measured before the write, so it includes waking up this thread but not the network
+                    metrics.observe_green_delivery(time.monotonic() - changedAt)
+        except (BrokenPipeError, ConnectionResetError, TimeoutError):
+            debug_log("display disconnected from " + gateName)
+        finally:
+            metrics.display_connected(-1)
+
+    def handle_post(self):
+        action, gateName = parse_path(self.path)
+
+        if action == 'go':
+            if not self.valid_gate_name(gateName):
+                return action
+            gate = create_gate(gateName)
+            debug_log("go POST " + gate.name)
+            gate.go()
+            self.send_text(f"GO! signal for the next {gate.timeDelay} seconds.")
+            return action
+        else:
+            self.send_error(404)
+            return 'other'
+
+class TrafficLightServer(http.server.ThreadingHTTPServer):
+    # Every connection is served on its own thread, so a slow client does not block the others
+    daemon_threads = True
+    # Connections waiting to be accepted, the default of 5 is too low for many displays and cameras
+    request_queue_size = 128
 
 # Create server instance for defined port
-server_80 = socketserver.TCPServer((binding_ip, binding_port), MyHandler)
+server_80 = TrafficLightServer((binding_ip, binding_port), MyHandler)
 
 print(f"Serving on {binding_ip}:{binding_port}")
 
-# Start each server in a separate thread
-server_thread_80 = threading.Thread(target=server_80.serve_forever)
-server_thread_80.daemon = True
-server_thread_80.start()
-
 try:
-    while True:
-        pass  # Keep the script running to handle requests
+    # Serves on the main thread, waiting for requests does not use the CPU
+    server_80.serve_forever()
 
 except KeyboardInterrupt:
     print("\nServers interrupted by the user.")
 
 finally:
-    # Shutdown the servers gracefully
-    server_80.shutdown()
-    server_80.server_close()
\ No newline at end of file
+    server_80.server_close()
@@ -0,0 +1,21 @@
+from .client import (DEFAULT_GRAPHQL_URL, DEFAULT_REST_URL, RETRY_STATUS_CODES, SmartFaceClient,
+                     SmartFaceError)
+from .aio import AsyncSmartFaceClient
+from .archive import ImageArchive, load_archive_index, read_archived_image
+from .export import bounded_map, link_file, stream_to_archive, stream_to_file
+
+__all__ = [
+    "AsyncSmartFaceClient",
+    "DEFAULT_GRAPHQL_URL",
+    "DEFAULT_REST_URL",
+    "ImageArchive",
+    "RETRY_STATUS_CODES",
+    "SmartFaceClient",
+    "SmartFaceError",
+    "bounded_map",
+    "link_file",
+    "stream_to_archive",
+    "stream_to_file",
+    "load_archive_index",
+    "read_archived_image",
+]
@@ -0,0 +1,66 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import requests
+
+from .client import SmartFaceClient
+
+
+class AsyncSmartFaceClient:
+    # asyncio front end of SmartFaceClient. Requests run on a thread pool as large as the connection
+    # pool, so up to pool_size calls are in flight while the event loop keeps running. Timeouts,
+    # retries and keep-alive come from the wrapped client, and no extra HTTP library is needed.
+
+    def __init__(self, client: Optional[SmartFaceClient] = None, **kwargs):
+        self.client = client or SmartFaceClient(**kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=self.client.pool_size)
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        # The body is read on the worker thread, streaming responses are not supported here
+        kwargs.pop("stream", None)
+        return await self.run(self.client.request, method, path, **kwargs)
+
+    async def get(self, path: str, **kwargs) -> requests.Response:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> requests.Response:
+        return await self.request("POST", path, **kwargs)
+
+    async def rest(self, method: str, path: str, **kwargs) -> Any:
+        return await self.run(self.client.rest, method, path, **kwargs)
+
+    async def graphql(self, query: str, variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return await self.run(self.client.graphql, query, variables)
+
+    async def iter_pages(self, pages) -> AsyncIterator[Any]:
+        # Drives a blocking page iterator from the executor, one page per await
+        done = object()
+        while True:
+            page = await self.run(next, pages, done)
+            if page is done:
+                return
+            yield page
+
+    async def iter_rest_items(self, path: str, page_size: int = 100, params: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        async for item in self.iter_pages(self.client.iter_rest_items(path, page_size, params)):
+            yield item
+
+    async def iter_graphql_pages(self, query: str, item_type: str, take: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+        async for page in self.iter_pages(self.client.iter_graphql_pages(query, item_type, take)):
+            yield page
+
+    async def aclose(self):
+        self.executor.shutdown(wait=True)
+        self.client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
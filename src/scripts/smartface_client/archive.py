@@ -0,0 +1,78 @@
+import csv
+import glob
+import os
+import tarfile
+import threading
+import time
+
+
+class ImageArchive:
+    # Packs images into tar shards of at most shard_size bytes instead of one file per image.
+    # The index file maps every image id to its shard and the byte offset of its data,
+    # so a single image can be read back with one seek (see read_archived_image).
+
+    def __init__(self, folder, name, shard_size):
+        self.folder = folder
+        self.name = name
+        self.shard_size = shard_size
+        self.lock = threading.Lock()
+        self.tar = None
+        self.shard_path = None
+        # Continue numbering after shards left by an earlier run, so they are never overwritten
+        self.shard_number = len(glob.glob(os.path.join(folder, glob.escape(name) + ".*.tar")))
+        self.index_path = os.path.join(folder, f"{name}.archive-index.csv")
+        is_new_index = not os.path.exists(self.index_path)
+        self.index_file = open(self.index_path, "a", newline="")
+        self.index_writer = csv.writer(self.index_file)
+        if is_new_index:
+            self.index_writer.writerow(["image_id", "shard", "offset", "size"])
+
+    def open_next_shard(self):
+        if self.tar:
+            self.tar.close()
+        self.shard_path = os.path.join(self.folder, f"{self.name}.{self.shard_number:05d}.tar")
+        self.shard_number += 1
+        self.tar = tarfile.open(self.shard_path, "w", format=tarfile.USTAR_FORMAT)
+
+    def add(self, image_id, fileobj, size):
+        info = tarfile.TarInfo(f"{image_id}.jpg")
+        info.size = size
+        info.mtime = int(time.time())
+
+        with self.lock:
+            if self.tar is None or (self.tar.offset > 0 and self.tar.offset + size > self.shard_size):
+                self.open_next_shard()
+            # Image data starts right after the member header
+            offset = self.tar.offset + len(info.tobuf(self.tar.format, self.tar.encoding, self.tar.errors))
+            self.tar.addfile(info, fileobj)
+            entry = (os.path.basename(self.shard_path), offset, size)
+            self.index_writer.writerow([image_id, *entry])
+        return entry
+
+    def add_reference(self, image_id, entry):
+        # Points an id at image data that is already packed, possibly in another archive of the same folder
+        with self.lock:
+            self.index_writer.writerow([image_id, *entry])
+
+    def close(self):
+        with self.lock:
+            if self.tar:
+                self.tar.close()
+            self.index_file.close()
+
+
+def load_archive_index(folder):
+    # image id -> (shard path, offset, size) for every archive index in the folder
+    index = {}
+    for index_path in sorted(glob.glob(os.path.join(folder, "*.archive-index.csv"))):
+        with open(index_path, newline="") as index_file:
+            for row in csv.DictReader(index_file):
+                index[row["image_id"]] = (os.path.join(folder, row["shard"]), int(row["offset"]), int(row["size"]))
+    return index
+
+
+def read_archived_image(index, image_id):
+    shard_path, offset, size = index[image_id]
+    with open(shard_path, "rb") as shard:
+        shard.seek(offset)
+        return shard.read(size)
@@ -0,0 +1,134 @@
+import random
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+import requests.adapters
+
+DEFAULT_REST_URL = "http://localhost:8098"
+DEFAULT_GRAPHQL_URL = "http://localhost:8097/graphql"
+
+# Responses that usually mean the server is busy or restarting, worth another attempt
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+
+class SmartFaceError(Exception):
+    # Raised for REST responses with an error status and for GraphQL responses with errors
+    def __init__(self, message, status_code=None, errors=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.errors = errors
+
+
+class SmartFaceClient:
+    # Pooled client for the SmartFace REST and GraphQL APIs. One instance keeps up to pool_size
+    # keep-alive connections per host and can be shared by threads. Every request gets a timeout
+    # and is retried on connection errors and RETRY_STATUS_CODES with jittered exponential backoff.
+
+    def __init__(self, rest_url=DEFAULT_REST_URL, graphql_url=DEFAULT_GRAPHQL_URL, pool_size=10,
+                 timeout=30, retries=3, backoff=0.5, max_backoff=10.0):
+        self.rest_url = rest_url.rstrip("/") if rest_url else rest_url
+        self.graphql_url = graphql_url
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def url(self, path: str) -> str:
+        # Absolute URLs are used as they are, paths are relative to the REST API
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return self.rest_url + "/" + path.lstrip("/")
+
+    def backoff_delay(self, attempt: int) -> float:
+        # Full jitter: a random delay up to the exponential bound, so retrying clients do not
+        # hit a recovering server at the same moment
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request(self, method: str, path: str, retries: Optional[int] = None, **kwargs) -> requests.Response:
+        # Same arguments as requests.Session.request; the response is returned whatever its status.
+        # Pass retries=0 for calls that must not be repeated, e.g. creating an entity.
+        kwargs.setdefault("timeout", self.timeout)
+        url = self.url(path)
+        retries = self.retries if retries is None else retries
+
+        for attempt in range(retries + 1):
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt == retries:
+                    return response
+                response.close()
+            time.sleep(self.backoff_delay(attempt))
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def rest(self, method: str, path: str, **kwargs) -> Any:
+        # Parsed JSON body of a REST call, SmartFaceError for error statuses
+        response = self.request(method, path, **kwargs)
+        if response.status_code >= 400:
+            raise SmartFaceError(f"{method} {path} failed with status code {response.status_code}",
+                                 status_code=response.status_code)
+        return response.json() if response.content else None
+
+    def graphql_response(self, query: str, variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        # Whole GraphQL response, including the errors list if the server returned one
+        payload = {"query": query}
+        if variables:
+            payload["variables"] = variables
+        response = self.post(self.graphql_url, json=payload, headers={"Content-Type": "application/json"})
+        return response.json()
+
+    def graphql(self, query: str, variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        response_data = self.graphql_response(query, variables)
+        if response_data.get("errors"):
+            raise SmartFaceError(f"GraphQL query failed: {response_data['errors']}", errors=response_data["errors"])
+        return response_data.get("data") or {}
+
+    def iter_rest_items(self, path: str, page_size: int = 100, params: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        # Items of a paged REST list (PageNumber/PageSize, followed until nextPage is empty)
+        page_number = 1
+        while True:
+            page = self.rest("GET", path, params=dict(params or {}, PageNumber=page_number, PageSize=page_size))
+            yield from page.get("items", [])
+            if not page.get("nextPage"):
+                return
+            page_number += 1
+
+    def iter_graphql_pages(self, query: str, item_type: str, take: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        # Pages of a take/skip GraphQL query; the query has {take} and {skip} placeholders
+        skip = 0
+        while True:
+            data = self.graphql(query.replace("{take}", str(take)).replace("{skip}", str(skip)))
+            items = (data.get(item_type) or {}).get("items") or []
+            if items:
+                yield items
+            if len(items) < take:
+                return
+            skip += take
+
+    def iter_graphql_items(self, query: str, item_type: str, take: int = 1000) -> Iterator[Dict[str, Any]]:
+        for page in self.iter_graphql_pages(query, item_type, take):
+            yield from page
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
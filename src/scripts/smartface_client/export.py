@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+from collections import deque
+
+
+def link_file(source_path, target_path):
+    # A hard link costs no extra disk space; fall back to a copy where links are not supported
+    if os.path.abspath(source_path) == os.path.abspath(target_path):
+        return
+    if os.path.exists(target_path):
+        os.remove(target_path)
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copyfile(source_path, target_path)
+
+
+def bounded_map(executor, fn, iterable, window):
+    # Like executor.map, but only pulls the next input once fewer than `window` calls are pending,
+    # so a lazily paginated input (pages of items, batches of members) is never read far ahead of the downloads.
+    pending = deque()
+    for item in iterable:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+def stream_to_file(response, file_path, chunk_size):
+    # Writes a streamed image body to file_path and returns its size. The body goes to a .part file that is
+    # renamed at the end, so an interrupted download never leaves a truncated image behind.
+    partial_path = file_path + ".part"
+    size = 0
+    with open(partial_path, "wb") as file:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            file.write(chunk)
+            size += len(chunk)
+    os.replace(partial_path, file_path)
+    return size
+
+
+def stream_to_archive(response, archive, image_id, chunk_size):
+    # Packs a streamed image body into an ImageArchive and returns its (shard, offset, size) entry.
+    # The first chunks stay in memory, anything larger spills to a temporary file before being packed.
+    with tempfile.SpooledTemporaryFile(max_size=chunk_size) as spool:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            spool.write(chunk)
+        size = spool.tell()
+        spool.seek(0)
+        return archive.add(image_id, spool, size)